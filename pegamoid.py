@@ -14,7 +14,7 @@ import traceback
 import sys
 tb = ''
 try:
-  from qtpy.QtCore import Qt, QObject, QThread, QEvent, QSettings
+  from qtpy.QtCore import Qt, QObject, QThread, QTimer, QEvent, QSettings
   from qtpy.QtWidgets import *
   from qtpy.QtGui import QPixmap, QIcon, QKeySequence, QColor, QPalette, QScreen, QCursor
   import qtpy
@@ -28,14 +28,14 @@ try:
 except:
   tb += traceback.format_exc()
   try:
-    from PyQt5.QtCore import Qt, QObject, QThread, QEvent, QSettings, PYQT_VERSION_STR, QT_VERSION_STR
+    from PyQt5.QtCore import Qt, QObject, QThread, QTimer, QEvent, QSettings, PYQT_VERSION_STR, QT_VERSION_STR
     from PyQt5.QtWidgets import *
     from PyQt5.QtGui import QPixmap, QIcon, QKeySequence, QColor, QPalette, QScreen, QCursor
     QtVersion = 'PyQt5 {0} (Qt {1})'.format(PYQT_VERSION_STR, QT_VERSION_STR)
   except ImportError:
     tb += traceback.format_exc()
     try:
-      from PyQt4.QtCore import Qt, QObject, QThread, QEvent, QSettings, PYQT_VERSION_STR, QT_VERSION_STR
+      from PyQt4.QtCore import Qt, QObject, QThread, QTimer, QEvent, QSettings, PYQT_VERSION_STR, QT_VERSION_STR
       from PyQt4.QtGui import *
       QtVersion = 'PyQt4 {0} (Qt {1})'.format(PYQT_VERSION_STR, QT_VERSION_STR)
     except ImportError:
@@ -67,15 +67,17 @@ from fractions import Fraction
 import os.path
 import codecs
 import re
-import struct
 import time
-from copy import deepcopy
+import threading
 from socket import gethostname
 from datetime import datetime
 from tempfile import mkdtemp, TemporaryFile
-from shutil import rmtree
+from shutil import rmtree, copyfileobj
 from functools import partial
-from collections import OrderedDict
+from operator import itemgetter
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 try:
   from itertools import zip_longest
 except ImportError:
@@ -84,6 +86,10 @@ try:
   from ttfquery._scriptregistry import registry
 except ImportError:
   pass
+try:
+  import numba
+except ImportError:
+  numba = None
 
 icondata = codecs.decode(b'''
 iVBORw0KGgoAAAANSUhEUgAAADAAAAAwCAYAAABXAvmHAAAABGdBTUEAALGPC/xhBQAAAAFzUkdC
@@ -206,6 +212,46 @@ symmult = np.array([
   [7, 6, 5, 4, 3, 2, 1, 0],
 ])
 
+#===============================================================================
+# Compiled kernels for evaluating orbitals in a grid, numba is optional and
+# the equivalent numpy expressions are used if it is not available
+
+if (numba is not None):
+
+  # Contracted Gaussian: sum of c*exp(-e*r2) over all primitives
+  @numba.njit(parallel=True, fastmath=True, cache=True)
+  def _rad_kernel(r2, e, c, out):
+    for i in numba.prange(r2.size):
+      val = 0.0
+      for j in range(e.size):
+        val += c[j]*np.exp(-e[j]*r2[i])
+      out[i] = val
+
+  # Several contracted Gaussians sharing the primitives: each exp(-e*r2)
+  # is computed once and added to all shells, c has one row per shell
+  @numba.njit(parallel=True, fastmath=True, cache=True)
+  def _rads_kernel(r2, e, c, out):
+    for i in numba.prange(r2.size):
+      for k in range(c.shape[0]):
+        out[k,i] = 0.0
+      for j in range(e.size):
+        x = np.exp(-e[j]*r2[i])
+        for k in range(c.shape[0]):
+          out[k,i] += c[k,j]*x
+
+  # Add coeff*ang*rad to mo in place, without temporary arrays
+  @numba.njit(parallel=True, fastmath=True, cache=True)
+  def _mo_kernel(mo, coeff, ang, rad):
+    for i in numba.prange(mo.size):
+      mo[i] += coeff*ang[i]*rad[i]
+
+# Add the contribution of an atomic orbital (angular times radial part) to a molecular orbital
+def add_ao(mo, coeff, ang, rad):
+  if ((numba is not None) and (np.ndim(mo) == np.ndim(ang) == np.ndim(rad) == 1)):
+    _mo_kernel(mo, coeff, ang, rad)
+  else:
+    mo += coeff*ang*rad
+
 #===============================================================================
 # Class for orbitals defined in term of basis functions, which can be computed
 # at arbitrary points in space.
@@ -222,11 +268,16 @@ class Orbitals(object):
     self.eps = np.finfo(float).eps
     self.wf = 'SCF'
     self.title = ''
+    self._sorted_coeff = {}
+    self._bf_table = None
+    self._rads_coeffs = {}
     if (self.type == 'hdf5'):
       self.inporb = 'gen'
       self.h5file = self.file
-      self.read_h5_basis()
-      self.read_h5_MO()
+      # Read basis and orbitals with a single open of the file
+      with open_h5(self.file) as f:
+        self.read_h5_basis(f)
+        self.read_h5_MO(f)
       self.get_orbitals('State', 0)
     elif (self.type == 'molden'):
       self.read_molden_basis()
@@ -234,142 +285,159 @@ class Orbitals(object):
     self.normalize_rad()
 
   # Read basis set from an HDF5 file
-  def read_h5_basis(self):
-    with h5py.File(self.file, 'r') as f:
-      otype = f.attrs.get('ORBITAL_TYPE', b'').decode('ascii')
-      mod = f.attrs.get('MOLCAS_MODULE', b'').decode('ascii')
-      self.title = ': '.join([i for i in [mod, otype] if i])
-      sym = f.attrs['NSYM']
-      self.N_bas = f.attrs['NBAS']
-      self.irrep = [i.decode('ascii').strip() for i in f.attrs['IRREP_LABELS']]
-      # First read the centers and their properties
-      if (sym > 1):
-        labels = f['DESYM_CENTER_LABELS'][:]
-        try:
-          charges = f['DESYM_CENTER_ATNUMS'][:]
-        except KeyError:
-          charges = f['DESYM_CENTER_CHARGES'][:]
-        coords = f['DESYM_CENTER_COORDINATES'][:]
-        self.mat = np.reshape(f['DESYM_MATRIX'][:], (sum(self.N_bas), sum(self.N_bas))).T
-      else:
-        labels = f['CENTER_LABELS'][:]
-        try:
-          charges = f['CENTER_ATNUMS'][:]
-        except KeyError:
-          charges = f['CENTER_CHARGES'][:]
-        coords = f['CENTER_COORDINATES'][:]
-      charges = charges.astype(int).clip(0, maxZ)
-      self.centers = [{'name':str(l.decode('ascii')).strip(), 'Z':q, 'xyz':x} for l,q,x in zip(labels, charges, coords)]
-      self.geomcenter = (np.amin(coords, axis=0) + np.amax(coords, axis=0))/2
-      # Then read the primitives and assign them to the centers
-      prims = f['PRIMITIVES'][:]    # (exponent, coefficient)
-      prids = f['PRIMITIVE_IDS'][:] # (center, l, shell)
-      # The basis_id contains negative l if the shell is Cartesian
-      if (sym > 1):
-        basis_function_ids = 'DESYM_BASIS_FUNCTION_IDS'
-      else:
-        basis_function_ids = 'BASIS_FUNCTION_IDS'
-      bf_id = np.rec.fromrecords(np.insert(f[basis_function_ids][:], 4, -1, axis=1), names='c, s, l, m, tl') # (center, shell, l, m, true-l)
-      bf_cart = set([(b['c'], b['l'], b['s']) for b in bf_id if (b['l'] < 0)])
-      for i,c in enumerate(self.centers):
-        c['bf_ids'] = np.where(bf_id['c'] == i+1)[0].tolist()
-      # Add contaminants, which are found as lower l basis functions after higher l ones
-      # The "tl" field means the "l" from which exponents and coefficients are to be taken, or "true l"
-      ii = [sum(self.N_bas[:i]) for i in range(len(self.N_bas))]
+  def read_h5_basis(self, f):
+    otype = f.attrs.get('ORBITAL_TYPE', b'').decode('ascii')
+    mod = f.attrs.get('MOLCAS_MODULE', b'').decode('ascii')
+    self.title = ': '.join([i for i in [mod, otype] if i])
+    sym = f.attrs['NSYM']
+    self.N_bas = f.attrs['NBAS']
+    self.set_nbas()
+    self.irrep = [i.decode('ascii').strip() for i in f.attrs['IRREP_LABELS']]
+    # First read the centers and their properties
+    if (sym > 1):
+      labels = f['DESYM_CENTER_LABELS'][:]
+      try:
+        charges = f['DESYM_CENTER_ATNUMS'][:]
+      except KeyError:
+        charges = f['DESYM_CENTER_CHARGES'][:]
+      coords = f['DESYM_CENTER_COORDINATES'][:]
+      self.mat = np.reshape(f['DESYM_MATRIX'][:], (self._nbas_total, self._nbas_total)).T
+    else:
+      labels = f['CENTER_LABELS'][:]
+      try:
+        charges = f['CENTER_ATNUMS'][:]
+      except KeyError:
+        charges = f['CENTER_CHARGES'][:]
+      coords = f['CENTER_COORDINATES'][:]
+    charges = charges.astype(int).clip(0, maxZ)
+    self.centers = [{'name':str(l.decode('ascii')).strip(), 'Z':q, 'xyz':x} for l,q,x in zip(labels, charges, coords)]
+    # Then read the primitives and assign them to the centers
+    prims = f['PRIMITIVES'][:]    # (exponent, coefficient)
+    prids = f['PRIMITIVE_IDS'][:] # (center, l, shell)
+    # The basis_id contains negative l if the shell is Cartesian
+    if (sym > 1):
+      basis_function_ids = 'DESYM_BASIS_FUNCTION_IDS'
+    else:
+      basis_function_ids = 'BASIS_FUNCTION_IDS'
+    # Keep the basis function IDs as separate columns: center, shell, l, m, true-l
+    bf_c, bf_s, bf_l, bf_m = f[basis_function_ids][:].T.astype(np.int32)
+    bf_tl = bf_l.copy()
+    cart = bf_l < 0
+    bf_cart = set(zip(bf_c[cart].tolist(), bf_l[cart].tolist(), bf_s[cart].tolist()))
+    # Group the basis functions by center in one pass (centers are numbered from 1)
+    nc = len(self.centers)
+    order = np.argsort(bf_c, kind='stable')
+    order = order[(bf_c[order] > 0) & (bf_c[order] <= nc)]
+    counts = np.bincount(bf_c[order], minlength=nc+1)[1:]
+    for c,ids in zip(self.centers, np.split(order, np.cumsum(counts)[:-1])):
+      c['bf_ids'] = ids.tolist()
+    # Add contaminants, which are found as lower l basis functions after higher l ones
+    # The "tl" field means the "l" from which exponents and coefficients are to be taken, or "true l"
+    ii = self._nbas_cum[:-1]
+    if (sym > 1):
+      sbf_c, sbf_s, sbf_l, sbf_m = f['BASIS_FUNCTION_IDS'][:].T.astype(np.int32)
+      sbf_tl = sbf_l.copy()
+    else:
+      sbf_c, sbf_s, sbf_l, sbf_m, sbf_tl = bf_c, bf_s, bf_l, bf_m, bf_tl
+    # Within each run of functions in the same center (and irrep), tl is the l
+    # of the last function with |l| not lower than that of all previous ones,
+    # this is computed for all functions at once
+    n = len(sbf_c)
+    if (n > 0):
+      start = np.ones(n, dtype=bool)
+      start[1:] = sbf_c[1:] != sbf_c[:-1]
+      start[ii[ii < n]] = True
+      seg = np.cumsum(start)
+      al = np.abs(sbf_l)
+      big = int(al.max())+1
+      runmax = np.maximum.accumulate(al + seg*big) - seg*big
+      last = np.maximum.accumulate(np.where(al == runmax, np.arange(n), 0))
+      sbf_tl[:] = sbf_l[last]
+    if (sym > 1):
+      i, j = np.nonzero(self.mat.T)
+      assert (np.all(bf_l[j] == sbf_l[i]) and np.all(bf_s[j] == sbf_s[i]) and np.all(bf_m[j] == sbf_m[i]))
+      bf_tl[j] = sbf_tl[i]
+    # Workaround for bug in HDF5 files where p-type contaminants did all have m=0
+    p0 = (bf_l == 1) & (bf_m == 0)
+    if (np.any(p0)):
+      p_shells, p0_counts = np.unique(np.stack([bf_c[p0], bf_s[p0], bf_tl[p0]], axis=1), axis=0, return_counts=True)
+    else:
+      p_shells, p0_counts = np.zeros((0, 3), dtype=int), np.zeros(0, dtype=int)
+    if (np.any(p0_counts > 1)):
       if (sym > 1):
-        sbf_id = np.rec.fromrecords(np.insert(f['BASIS_FUNCTION_IDS'][:], 4, -1, axis=1), names='c, s, l, m, tl')
+        # can't fix it with symmetry
+        error = 'Bad m for p contaminants. The file could have been created by a buggy or unsupported OpenMolcas version'
+        raise Exception(error)
       else:
-        sbf_id = bf_id
-      for i,nb in zip(ii, self.N_bas):
-        prev = {'c': -1, 'l': -1, 's': -1, 'tl': 0, 'm': None}
-        for b in sbf_id[i:i+nb]:
-          if (b['c']==prev['c'] and abs(b['l']) < abs(prev['tl'])):
-            b['tl'] = prev['tl']
-          else:
-            b['tl'] = b['l']
-          prev = {n: b[n] for n in b.dtype.names}
-      if (sym > 1):
-        for i,b in enumerate(self.mat.T):
-          bb = np.array(sbf_id[i])
-          nz = np.nonzero(b)[0]
-          assert (np.all(bf_id[nz][['l','s','m']] == bb[['l','s','m']]))
-          for j in nz:
-            bf_id[j]['tl'] = bb['tl']
-      # Workaround for bug in HDF5 files where p-type contaminants did all have m=0
-      p_shells, p0_counts = np.unique([np.array(b)[['c','s','tl']].copy() for b in bf_id if ((b['l']==1) and (b['m']==0))], return_counts=True)
-      if (np.any(p0_counts > 1)):
-        if (sym > 1):
-          # can't fix it with symmetry
-          error = 'Bad m for p contaminants. The file could have been created by a buggy or unsupported OpenMolcas version'
-          raise Exception(error)
-        else:
-          m = -1
-          for i in np.where(bf_id['l']==1)[0]:
-            bi = list(p_shells).index(bf_id[i][['c','s','tl']])
-            if (p0_counts[bi] > 1):
-              bf_id[i]['m'] = m
-              m += 1
-              if (m > 1):
-                m = -1
-      # Count the number of m per basis to make sure it matches with the expected type
-      counts = {}
-      for b in bf_id:
-        key = (b['c'], b['l'], b['s'], b['tl'])
-        counts[key] = counts.get(key, 0)+1
-      for ff,n in counts.items():
-        l = ff[1]
-        if (((l >= 0) and (n != 2*l+1)) or ((l < 0) and (n != (-l+1)*(-l+2)/2))):
-          error = 'Inconsistent basis function IDs. The file could have been created by a buggy or unsupported OpenMolcas version'
-          raise Exception(error)
-      # Maximum angular momentum in the whole basis set,
-      maxl = max([p[1] for p in prids])
-      for i,c in enumerate(self.centers):
-        c['basis'] = []
-        c['cart'] = {}
-        for l in range(maxl+1):
-          ll = []
-          # number of shells for this l and center
-          maxshell = max([0] + [p[2] for p in prids if ((p[0] == i+1) and (p[1] == l))])
-          for s in range(maxshell):
-            # find out if this is a Cartesian shell (if the l is negative)
-            # note that Cartesian shells never have (nor are) contaminants,
-            # and since contaminants come after regular shells,
-            # it should be safe to save just l and s
-            if ((i+1, -l, s+1) in bf_cart):
-              c['cart'][(l, s)] = True
-            # get exponents and coefficients
-            ll.append([0, [pp.tolist() for p,pp in zip(prids, prims) if ((p[0] == i+1) and (p[1] == l) and (p[2] == s+1))]])
-          c['basis'].append(ll)
-        # Add contaminant shells, that is, additional shells for lower l, with exponents and coefficients
-        # from a higher l, and with some power of r**2
-        for l in range(maxl-1):
-          # find basis functions for this center and l, where l != tl
-          cont = [(b['l'],b['tl'],b['s']) for b in bf_id[np.logical_and(bf_id['c']==i+1, bf_id['l']==l)] if (b['l'] != b['tl'])]
-          # get a sorted unique set
-          cont = sorted(set(cont))
-          # copy the exponents and coefficients from the higher l and set the power of r**2
-          for j in cont:
-            new = deepcopy(c['basis'][j[1]][j[2]-1])
-            new[0] = (j[1]-j[0])//2
-            c['basis'][l].append(new)
-      # At this point each center[i]['basis'] is a list of maxl items, one for each value of l,
-      # each item is a list of shells,
-      # each item is [power of r**2, primitives],
-      # each "primitives" is a list of [exponent, coefficient]
-      # Now get the indices for sorting all the basis functions (2l+1 or (l+1)(l+2)/2 for each shell)
-      # by center, l, m, "true l", shell
-      # To get the correct sorting for Cartesian shells, invert l
-      for b in bf_id:
-        if (b['l'] < 0):
-          b['l'] *= -1
-      self.bf_sort = np.argsort(bf_id, order=('c', 'l', 'm', 'tl', 's'))
-      # And sph_c can be computed
-      self.set_sph_c(maxl)
+        # Assign m=-1,0,1 cyclically to the p functions of the wrong shells, in order
+        bad = set(map(tuple, p_shells[p0_counts > 1].tolist()))
+        p1 = np.flatnonzero(bf_l == 1)
+        p1 = p1[[tuple(k) in bad for k in zip(bf_c[p1].tolist(), bf_s[p1].tolist(), bf_tl[p1].tolist())]]
+        bf_m[p1] = np.arange(len(p1)) % 3 - 1
+    # Count the number of m per basis to make sure it matches with the expected type
+    if (len(bf_c) > 0):
+      keys, counts = np.unique(np.stack([bf_c, bf_l, bf_s, bf_tl], axis=1), axis=0, return_counts=True)
+      l = keys[:,1]
+      expected = np.where(l >= 0, 2*l+1, (-l+1)*(-l+2)//2)
+      if (np.any(counts != expected)):
+        error = 'Inconsistent basis function IDs. The file could have been created by a buggy or unsupported OpenMolcas version'
+        raise Exception(error)
+    # Maximum angular momentum in the whole basis set,
+    maxl = int(np.max(prids[:,1]))
+    # Group the primitives by (center, l, shell) in a single pass,
+    # the sort is stable, so the order of primitives in each shell is kept
+    order = np.lexsort((prids[:,2], prids[:,1], prids[:,0]))
+    keys = prids[order]
+    bounds = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1))+1
+    shells = {}
+    nshell = {}
+    for k,p in zip(keys[np.r_[0, bounds]].tolist(), np.split(prims[order], bounds)):
+      shells[tuple(k)] = p.tolist()
+      nshell[(k[0], k[1])] = max(nshell.get((k[0], k[1]), 0), k[2])
+    # Contaminant shells (l != tl) for each center and l, as a sorted unique set of (tl, s)
+    conts = {}
+    cont = bf_l != bf_tl
+    if (np.any(cont)):
+      for k in np.unique(np.stack([bf_c[cont], bf_l[cont], bf_tl[cont], bf_s[cont]], axis=1), axis=0).tolist():
+        conts.setdefault((k[0], k[1]), []).append((k[2], k[3]))
+    for i,c in enumerate(self.centers):
+      c['basis'] = []
+      c['cart'] = {}
+      for l in range(maxl+1):
+        ll = []
+        # number of shells for this l and center
+        maxshell = nshell.get((i+1, l), 0)
+        for s in range(maxshell):
+          # find out if this is a Cartesian shell (if the l is negative)
+          # note that Cartesian shells never have (nor are) contaminants,
+          # and since contaminants come after regular shells,
+          # it should be safe to save just l and s
+          if ((i+1, -l, s+1) in bf_cart):
+            c['cart'][(l, s)] = True
+          # get exponents and coefficients
+          ll.append([0, shells.get((i+1, l, s+1), [])])
+        c['basis'].append(ll)
+      # Add contaminant shells, that is, additional shells for lower l, with exponents and coefficients
+      # from a higher l, and with some power of r**2
+      for l in range(maxl-1):
+        # copy the exponents and coefficients from the higher l and set the power of r**2
+        # (the pairs are copied because they are normalized in place later)
+        for tl,s in conts.get((i+1, l), []):
+          new = [(tl-l)//2, [pair[:] for pair in c['basis'][tl][s-1][1]]]
+          c['basis'][l].append(new)
+    # At this point each center[i]['basis'] is a list of maxl items, one for each value of l,
+    # each item is a list of shells,
+    # each item is [power of r**2, primitives],
+    # each "primitives" is a list of [exponent, coefficient]
+    # Now get the indices for sorting all the basis functions (2l+1 or (l+1)(l+2)/2 for each shell)
+    # by center, l, m, "true l", shell
+    # To get the correct sorting for Cartesian shells, invert l
+    # (lexsort uses the last key as primary)
+    self.bf_sort = np.lexsort((bf_s, bf_tl, bf_m, np.abs(bf_l), bf_c))
+    # And sph_c can be computed
+    self.set_sph_c(maxl)
     # center of atoms with basis
-    nb = [isEmpty(c['basis']) for c in self.centers]
-    if (any(nb) and not all(nb)):
-      xyz = [c['xyz'] for i,c in enumerate(self.centers) if not nb[i]]
-      self.geomcenter = (np.amin(xyz, axis=0) + np.amax(xyz, axis=0))/2
+    self.set_center_arrays()
     # Reading the basis set invalidates the orbitals, if any
     self.base_MO = None
     self.MO = None
@@ -378,180 +446,176 @@ class Orbitals(object):
     self.current_orbs = None
 
   # Read molecular orbitals from an HDF5 file
-  def read_h5_MO(self):
-    with h5py.File(self.file, 'r') as f:
-      # Read the orbital properties
-      if ('MO_ENERGIES' in f):
-        mo_en = f['MO_ENERGIES'][:]
-        mo_oc = f['MO_OCCUPATIONS'][:]
-        mo_cf = f['MO_VECTORS'][:]
-        if ('MO_TYPEINDICES' in f):
-          mo_ti = f['MO_TYPEINDICES'][:]
-        else:
-          mo_ti = [b'?' for i in mo_oc]
+  def read_h5_MO(self, f):
+    # Read the orbital properties
+    if ('MO_ENERGIES' in f):
+      mo_en = f['MO_ENERGIES'][:]
+      mo_oc = f['MO_OCCUPATIONS'][:]
+      mo_cf = f['MO_VECTORS'][:]
+      if ('MO_TYPEINDICES' in f):
+        mo_ti = f['MO_TYPEINDICES'][:]
       else:
-        mo_en = []
-        mo_oc = []
-        mo_cf = []
-        mo_ti = []
-      if ('MO_ALPHA_ENERGIES' in f):
-        mo_en_a = f['MO_ALPHA_ENERGIES'][:]
-        mo_oc_a = f['MO_ALPHA_OCCUPATIONS'][:]
-        mo_cf_a = f['MO_ALPHA_VECTORS'][:]
-        if ('MO_ALPHA_TYPEINDICES' in f):
-          mo_ti_a = f['MO_ALPHA_TYPEINDICES'][:]
-        else:
-          mo_ti_a = [b'?' for i in mo_oc_a]
+        mo_ti = [b'?' for i in mo_oc]
+    else:
+      mo_en = []
+      mo_oc = []
+      mo_cf = []
+      mo_ti = []
+    if ('MO_ALPHA_ENERGIES' in f):
+      mo_en_a = f['MO_ALPHA_ENERGIES'][:]
+      mo_oc_a = f['MO_ALPHA_OCCUPATIONS'][:]
+      mo_cf_a = f['MO_ALPHA_VECTORS'][:]
+      if ('MO_ALPHA_TYPEINDICES' in f):
+        mo_ti_a = f['MO_ALPHA_TYPEINDICES'][:]
       else:
-        mo_en_a = []
-        mo_oc_a = []
-        mo_cf_a = []
-        mo_ti_a = []
-      if ('MO_BETA_ENERGIES' in f):
-        mo_en_b = f['MO_BETA_ENERGIES'][:]
-        mo_oc_b = f['MO_BETA_OCCUPATIONS'][:]
-        mo_cf_b = f['MO_BETA_VECTORS'][:]
-        if ('MO_BETA_TYPEINDICES' in f):
-          mo_ti_b = f['MO_BETA_TYPEINDICES'][:]
-        else:
-          mo_ti_b = [b'?' for i in mo_oc_b]
+        mo_ti_a = [b'?' for i in mo_oc_a]
+    else:
+      mo_en_a = []
+      mo_oc_a = []
+      mo_cf_a = []
+      mo_ti_a = []
+    if ('MO_BETA_ENERGIES' in f):
+      mo_en_b = f['MO_BETA_ENERGIES'][:]
+      mo_oc_b = f['MO_BETA_OCCUPATIONS'][:]
+      mo_cf_b = f['MO_BETA_VECTORS'][:]
+      if ('MO_BETA_TYPEINDICES' in f):
+        mo_ti_b = f['MO_BETA_TYPEINDICES'][:]
       else:
-        mo_en_b = []
-        mo_oc_b = []
-        mo_cf_b = []
-        mo_ti_b = []
-      mo_ti = [str(i.decode('ascii')) for i in mo_ti]
-      mo_ti_a = [str(i.decode('ascii')) for i in mo_ti_a]
-      mo_ti_b = [str(i.decode('ascii')) for i in mo_ti_b]
-      self.base_MO = {}
-      self.base_MO[0] = [{'ene':e, 'occup':o, 'type':t} for e,o,t in zip(mo_en, mo_oc, mo_ti)]
-      self.base_MO['a'] = [{'ene':e, 'occup':o, 'type':t} for e,o,t in zip(mo_en_a, mo_oc_a, mo_ti_a)]
-      self.base_MO['b'] = [{'ene':e, 'occup':o, 'type':t} for e,o,t in zip(mo_en_b, mo_oc_b, mo_ti_b)]
-      # Read the coefficients
-      ii = [sum(self.N_bas[:i]) for i in range(len(self.N_bas))]
+        mo_ti_b = [b'?' for i in mo_oc_b]
+    else:
+      mo_en_b = []
+      mo_oc_b = []
+      mo_cf_b = []
+      mo_ti_b = []
+    mo_ti = [str(i.decode('ascii')) for i in mo_ti]
+    mo_ti_a = [str(i.decode('ascii')) for i in mo_ti_a]
+    mo_ti_b = [str(i.decode('ascii')) for i in mo_ti_b]
+    self.base_MO = {}
+    self.base_MO[0] = [{'ene':e, 'occup':o, 'type':t} for e,o,t in zip(mo_en, mo_oc, mo_ti)]
+    self.base_MO['a'] = [{'ene':e, 'occup':o, 'type':t} for e,o,t in zip(mo_en_a, mo_oc_a, mo_ti_a)]
+    self.base_MO['b'] = [{'ene':e, 'occup':o, 'type':t} for e,o,t in zip(mo_en_b, mo_oc_b, mo_ti_b)]
+    # Read the coefficients, each set of orbitals is filled as a matrix (one
+    # row per orbital) by symmetry blocks, and each orbital gets a row
+    ii = self._nbas_cum[:-1]
+    for orbs,cf in [(self.base_MO[0], mo_cf), (self.base_MO['a'], mo_cf_a), (self.base_MO['b'], mo_cf_b)]:
+      if (not orbs):
+        continue
+      coeff = np.zeros((len(orbs), self._nbas_total))
       j = 0
       for i,b,s in zip(ii, self.N_bas, self.irrep):
-        for orb,orb_a,orb_b in zip_longest(self.base_MO[0][i:i+b], self.base_MO['a'][i:i+b], self.base_MO['b'][i:i+b]):
-          if (orb):
-            orb['sym'] = s
-            orb['coeff'] = np.zeros(sum(self.N_bas))
-            orb['coeff'][i:i+b] = mo_cf[j:j+b]
-          if (orb_a):
-            orb_a['sym'] = s
-            orb_a['coeff'] = np.zeros(sum(self.N_bas))
-            orb_a['coeff'][i:i+b] = mo_cf_a[j:j+b]
-          if (orb_b):
-            orb_b['sym'] = s
-            orb_b['coeff'] = np.zeros(sum(self.N_bas))
-            orb_b['coeff'][i:i+b] = mo_cf_b[j:j+b]
-          j += b
-      # Desymmetrize the MOs
+        n = len(orbs[i:i+b])
+        for orb in orbs[i:i+b]:
+          orb['sym'] = s
+        coeff[i:i+n,i:i+b] = np.reshape(cf[j:j+n*b], (n, b))
+        # (the blocks are aligned for all sets)
+        j += b*max([len(o[i:i+b]) for o in self.base_MO.values()])
+      # Desymmetrize the MOs, all at once
       if (len(self.N_bas) > 1):
-        for orbs in self.base_MO.values():
-          for orb in orbs:
-            orb['coeff'] = np.dot(self.mat, orb['coeff'])
+        coeff = np.dot(coeff, self.mat.T)
+      for orb,c in zip(orbs, coeff):
+        orb['coeff'] = c
+    self.roots = [(0, 'Average')]
+    self.sdm = None
+    self.tdm = None
+    self.tsdm = None
+    mod = None
+    if ('MOLCAS_MODULE' in f.attrs):
+      mod = f.attrs['MOLCAS_MODULE'].decode('ascii')
+    if (mod == 'CASPT2'):
+      self.wf = 'PT2'
+      self.roots[0] = (0, 'Reference')
+      if ('DENSITY_MATRIX' in f):
+        try:
+          rootids = f.attrs['STATE_ROOTID'][:]
+        except KeyError:
+          rootids = [i+1 for i in range(f.attrs['NSTATES'])]
+        # For MS-CASPT2, the densities are SS, but the energies are MS,
+        # so take the energies from the effective Hamiltonian matrix instead
+        if ('H_EFF' in f):
+          H_eff = f['H_EFF']
+          self.roots.extend([(i+1, '{0}: {1:.6f}'.format(r, e)) for i,(r,e) in enumerate(zip(rootids, np.diag(H_eff)))])
+          self.msroots = [(0, 'Reference')]
+          self.msroots.extend([(i+1, '{0}: {1:.6f}'.format(i+1, e)) for i,e in enumerate(f['STATE_PT2_ENERGIES'])])
+        else:
+          self.roots.extend([(i+1, '{0}: {1:.6f}'.format(r, e)) for i,(r,e) in enumerate(zip(rootids, f['STATE_PT2_ENERGIES']))])
+    elif ('SFS_TRANSITION_DENSITIES' in f):
+      # This is a RASSI-like calculation, with TDMs
+      self.wf = 'SI'
       self.roots = [(0, 'Average')]
-      self.sdm = None
-      self.tdm = None
-      self.tsdm = None
-      mod = None
-      if ('MOLCAS_MODULE' in f.attrs):
-        mod = f.attrs['MOLCAS_MODULE'].decode('ascii')
-      if (mod == 'CASPT2'):
-        self.wf = 'PT2'
-        self.roots[0] = (0, 'Reference')
-        if ('DENSITY_MATRIX' in f):
-          try:
-            rootids = f.attrs['STATE_ROOTID'][:]
-          except KeyError:
-            rootids = [i+1 for i in range(f.attrs['NSTATES'])]
-          # For MS-CASPT2, the densities are SS, but the energies are MS,
-          # so take the energies from the effective Hamiltonian matrix instead
-          if ('H_EFF' in f):
-            H_eff = f['H_EFF']
-            self.roots.extend([(i+1, '{0}: {1:.6f}'.format(r, e)) for i,(r,e) in enumerate(zip(rootids, np.diag(H_eff)))])
-            self.msroots = [(0, 'Reference')]
-            self.msroots.extend([(i+1, '{0}: {1:.6f}'.format(i+1, e)) for i,e in enumerate(f['STATE_PT2_ENERGIES'])])
-          else:
-            self.roots.extend([(i+1, '{0}: {1:.6f}'.format(r, e)) for i,(r,e) in enumerate(zip(rootids, f['STATE_PT2_ENERGIES']))])
-      elif ('SFS_TRANSITION_DENSITIES' in f):
-        # This is a RASSI-like calculation, with TDMs
-        self.wf = 'SI'
-        self.roots = [(0, 'Average')]
-        mult = f.attrs['STATE_SPINMULT']
-        sym = f.attrs['STATE_IRREPS']
-        ene = f['SFS_ENERGIES'][:]
-        sup = [u'⁰', u'¹', u'²', u'³', u'⁴', u'⁵', u'⁶', u'⁷', u'⁸', u'⁹']
-        rootlist = []
-        for i,(e,m,s) in enumerate(zip(ene, mult, sym)):
-          try:
-            l = list(self.irrep[s-1])
-          except IndexError:
-            l = ['?']
-          l[0] = l[0].upper()
-          l = ''.join([sup[int(d)] for d in str(m)] + l)
-          rootlist.append((i+1, u'{0}: ({1}) {2:.6f}'.format(i+1, l, e)))
-        self.ene_idx = np.argsort(ene)
-        for i in self.ene_idx:
-          self.roots.append(rootlist[i])
-        self.tdm = True
-        if ('SFS_TRANSITION_SPIN_DENSITIES' in f):
+      mult = f.attrs['STATE_SPINMULT']
+      sym = f.attrs['STATE_IRREPS']
+      ene = f['SFS_ENERGIES'][:]
+      sup = [u'⁰', u'¹', u'²', u'³', u'⁴', u'⁵', u'⁶', u'⁷', u'⁸', u'⁹']
+      rootlist = []
+      for i,(e,m,s) in enumerate(zip(ene, mult, sym)):
+        try:
+          l = list(self.irrep[s-1])
+        except IndexError:
+          l = ['?']
+        l[0] = l[0].upper()
+        l = ''.join([sup[int(d)] for d in str(m)] + l)
+        rootlist.append((i+1, u'{0}: ({1}) {2:.6f}'.format(i+1, l, e)))
+      self.ene_idx = np.argsort(ene)
+      for i in self.ene_idx:
+        self.roots.append(rootlist[i])
+      self.tdm = True
+      if ('SFS_TRANSITION_SPIN_DENSITIES' in f):
+        self.sdm = True
+        if (any(mult != 1)):
+          self.tsdm = True
+      # find out which transitions are actually nonzero (stored)
+      self.have_tdm = np.zeros((len(ene), len(ene)), dtype=bool)
+      tdm = f['SFS_TRANSITION_DENSITIES']
+      if ('SFS_TRANSITION_SPIN_DENSITIES' in f):
+        tsdm = f['SFS_TRANSITION_SPIN_DENSITIES']
+      else:
+        tsdm = np.zeros_like(self.have_tdm)
+      for j in range(len(ene)):
+        for i in range(j):
+          if ((not np.allclose(tdm[i,j], 0)) or (not np.allclose(tsdm[i,j], 0))):
+            self.have_tdm[i,j] = True
+            self.have_tdm[j,i] = True
+      if (not np.any(self.have_tdm)):
+        self.tdm = False
+    else:
+      if ('DENSITY_MATRIX' in f):
+        rootids = [i+1 for i in range(f.attrs['NROOTS'])]
+        self.roots.extend([(i+1, '{0}: {1:.6f}'.format(r, e)) for i,(r,e) in enumerate(zip(rootids, f['ROOT_ENERGIES']))])
+      if ('SPINDENSITY_MATRIX' in f):
+        sdm = f['SPINDENSITY_MATRIX']
+        if (not np.allclose(sdm, 0)):
           self.sdm = True
-          if (any(mult != 1)):
+      if ('TRANSITION_DENSITY_MATRIX' in f):
+        tdm = f['TRANSITION_DENSITY_MATRIX']
+        if (not np.allclose(tdm, 0)):
+          self.tdm = True
+        if ('TRANSITION_SPIN_DENSITY_MATRIX' in f):
+          tsdm = f['TRANSITION_SPIN_DENSITY_MATRIX']
+          if (not np.allclose(tsdm, 0)):
             self.tsdm = True
+            self.tdm = True
         # find out which transitions are actually nonzero (stored)
-        self.have_tdm = np.zeros((len(ene), len(ene)), dtype=bool)
-        tdm = f['SFS_TRANSITION_DENSITIES']
-        if ('SFS_TRANSITION_SPIN_DENSITIES' in f):
-          tsdm = f['SFS_TRANSITION_SPIN_DENSITIES']
-        else:
-          tsdm = np.zeros_like(self.have_tdm)
-        for j in range(len(ene)):
-          for i in range(j):
-            if ((not np.allclose(tdm[i,j], 0)) or (not np.allclose(tsdm[i,j], 0))):
+        n = int(np.sqrt(1+8*tdm.shape[0])+1)//2
+        self.have_tdm = np.zeros((n, n), dtype=bool)
+        if ('TRANSITION_SPIN_DENSITY_MATRIX' not in f):
+          tsdm = np.zeros(n*(n-1)//2)
+        for i in range(n):
+          for j in range(i):
+            m = i*(i-1)//2+j
+            if ((not np.allclose(tdm[m], 0)) or (not np.allclose(tsdm[m], 0))):
               self.have_tdm[i,j] = True
               self.have_tdm[j,i] = True
         if (not np.any(self.have_tdm)):
           self.tdm = False
-      else:
-        if ('DENSITY_MATRIX' in f):
-          rootids = [i+1 for i in range(f.attrs['NROOTS'])]
-          self.roots.extend([(i+1, '{0}: {1:.6f}'.format(r, e)) for i,(r,e) in enumerate(zip(rootids, f['ROOT_ENERGIES']))])
-        if ('SPINDENSITY_MATRIX' in f):
-          sdm = f['SPINDENSITY_MATRIX']
-          if (not np.allclose(sdm, 0)):
-            self.sdm = True
-        if ('TRANSITION_DENSITY_MATRIX' in f):
-          tdm = f['TRANSITION_DENSITY_MATRIX']
-          if (not np.allclose(tdm, 0)):
-            self.tdm = True
-          if ('TRANSITION_SPIN_DENSITY_MATRIX' in f):
-            tsdm = f['TRANSITION_SPIN_DENSITY_MATRIX']
-            if (not np.allclose(tsdm, 0)):
-              self.tsdm = True
-              self.tdm = True
-          # find out which transitions are actually nonzero (stored)
-          n = int(np.sqrt(1+8*tdm.shape[0])+1)//2
-          self.have_tdm = np.zeros((n, n), dtype=bool)
-          if ('TRANSITION_SPIN_DENSITY_MATRIX' not in f):
-            tsdm = np.zeros(n*(n-1)//2)
-          for i in range(n):
-            for j in range(i):
-              m = i*(i-1)//2+j
-              if ((not np.allclose(tdm[m], 0)) or (not np.allclose(tsdm[m], 0))):
-                self.have_tdm[i,j] = True
-                self.have_tdm[j,i] = True
-          if (not np.any(self.have_tdm)):
-            self.tdm = False
-      if ('WFA' in f):
-        self.wfa_orbs = []
-        for i in f['WFA'].keys():
-          match = re.match('DESYM_(.*)_VECTORS', i)
-          if (match):
-            self.wfa_orbs.append(match.group(1))
-      # Read the optional notes
-      if ('Pegamoid_notes' in f):
-        self.notes = [str(i.decode('ascii')) for i in f['Pegamoid_notes'][:]]
+    if ('WFA' in f):
+      self.wfa_orbs = []
+      for i in f['WFA'].keys():
+        match = re.match('DESYM_(.*)_VECTORS', i)
+        if (match):
+          self.wfa_orbs.append(match.group(1))
+    # Read the optional notes
+    if ('Pegamoid_notes' in f):
+      self.notes = [str(i.decode('ascii')) for i in f['Pegamoid_notes'][:]]
 
   # Obtain a different type of MO orbitals (only for HDF5 files)
   def get_orbitals(self, density, root):
@@ -580,7 +644,7 @@ class Orbitals(object):
         if (self.wf == 'SI'):
           algo = 'eigsort'
           n = len(self.roots)-1
-          with h5py.File(self.file, 'r') as f:
+          with open_h5(self.file) as f:
             dm = f['SFS_TRANSITION_DENSITIES'][0,0,:]
             if (self.sdm):
               sdm = f['SFS_TRANSITION_SPIN_DENSITIES'][0,0,:]
@@ -595,7 +659,7 @@ class Orbitals(object):
           if (self.sdm):
             algo = 'eig'
             dm = np.diag([o['occup'] for o in self.base_MO[0] if (o['type'] in tp_act)])
-            with h5py.File(self.file, 'r') as f:
+            with open_h5(self.file) as f:
               sdm = np.mean(f['SPINDENSITY_MATRIX'], axis=0)
           else:
             algo = 'non'
@@ -604,7 +668,7 @@ class Orbitals(object):
             self.MO_b = self.base_MO['b']
       else:
         algo = 'eig'
-        with h5py.File(self.file, 'r') as f:
+        with open_h5(self.file) as f:
           if (self.wf == 'SI'):
             algo += 'sort'
             dm = f['SFS_TRANSITION_DENSITIES'][root-1,root-1,:]
@@ -620,16 +684,16 @@ class Orbitals(object):
         if (self.wf == 'SI'):
           algo += 'sort'
           n = len(self.roots)-1
-          with h5py.File(self.file, 'r') as f:
+          with open_h5(self.file) as f:
             dm = f['SFS_TRANSITION_SPIN_DENSITIES'][0,0,:]
             for i in range(1, n):
               dm += f['SFS_TRANSITION_SPIN_DENSITIES'][i,i,:]
           dm /= n
         else:
-          with h5py.File(self.file, 'r') as f:
+          with open_h5(self.file) as f:
             dm = np.mean(f['SPINDENSITY_MATRIX'], axis=0)
       else:
-        with h5py.File(self.file, 'r') as f:
+        with open_h5(self.file) as f:
           if (self.wf == 'SI'):
             algo += 'sort'
             dm = f['SFS_TRANSITION_SPIN_DENSITIES'][root-1,root-1,:]
@@ -640,7 +704,7 @@ class Orbitals(object):
       r2 = root[1] - 1
       if (density == 'Difference'):
         algo = 'eig'
-        with h5py.File(self.file, 'r') as f:
+        with open_h5(self.file) as f:
           if (self.wf == 'SI'):
             algo += 'sort'
             dm = f['SFS_TRANSITION_DENSITIES'][r2,r2,:] - f['SFS_TRANSITION_DENSITIES'][r1,r1,:]
@@ -660,7 +724,7 @@ class Orbitals(object):
           fact = 1
         elif ('(beta)' in density):
           fact = -1
-        with h5py.File(self.file, 'r') as f:
+        with open_h5(self.file) as f:
           if (self.wf == 'SI'):
             # find the symmetry of the transition
             sym = f.attrs['STATE_IRREPS']
@@ -677,7 +741,7 @@ class Orbitals(object):
       algo = 'non'
       label = self.wfa_orbs[root]
       new_MO = []
-      with h5py.File(self.h5file, 'r') as f:
+      with open_h5(self.h5file) as f:
         occ = f['WFA/DESYM_{0}_OCCUPATIONS'.format(label)][:]
         norb = len(occ)
         vec = np.reshape(f['WFA/DESYM_{0}_VECTORS'.format(label)], (norb, -1))
@@ -692,8 +756,8 @@ class Orbitals(object):
             break
       if (ntos):
         self.MO = []
-        self.MO_a = sorted(new_MO[int(norb/2):], key=lambda i: i['occup'], reverse=True)
-        self.MO_b = sorted(new_MO[:int(norb/2)], key=lambda i: i['occup'])
+        self.MO_a = sorted(new_MO[int(norb/2):], key=itemgetter('occup'), reverse=True)
+        self.MO_b = sorted(new_MO[:int(norb/2)], key=itemgetter('occup'))
         for o in self.MO_b:
           o['occup'] *= -1
       else:
@@ -705,9 +769,9 @@ class Orbitals(object):
         sdm = False
     # In RASSI, DMs are stored in (symmetrized) AO basis
     if ((self.wf == 'SI') and ('non' not in algo)):
-      with h5py.File(self.file, 'r') as f:
+      with open_h5(self.file) as f:
         S = f['AO_OVERLAP_MATRIX'][:]
-      tot = sum(self.N_bas)
+      tot = self._nbas_total
       full_S = np.zeros((tot, tot))
       full_D = np.zeros((tot, tot))
       if (sdm is not False):
@@ -715,12 +779,12 @@ class Orbitals(object):
       i = 0
       k = 0
       for s1,n1 in enumerate(self.N_bas):
-        j1 = np.sum(self.N_bas[:s1])
+        j1 = self._nbas_cum[s1]
         full_S[j1:j1+n1,j1:j1+n1] = np.reshape(S[i:i+n1*n1], (n1, n1))
         i += n1*n1
         s2 = np.flatnonzero(symmult[s1,:] == sym)[0]
         n2 = self.N_bas[s2]
-        j2 = np.sum(self.N_bas[:s2])
+        j2 = self._nbas_cum[s2]
         full_D[j2:j2+n2,j1:j1+n1] = np.reshape(dm[k:k+n1*n2], (n2, n1))
         if (sdm is not False):
           full_sD[j2:j2+n2,j1:j1+n1] = np.reshape(sdm[k:k+n1*n2], (n2, n1))
@@ -761,7 +825,7 @@ class Orbitals(object):
             o['coeff'] = X[:,i]
           act = new_MO
         else:
-          new_MO = deepcopy(self.base_MO[0])
+          new_MO = copy_MO(self.base_MO[0])
           act = [o for o in new_MO if (o['type'] in tp_act)]
         if (density in ['Difference', 'Spin']):
           for o in new_MO:
@@ -772,7 +836,7 @@ class Orbitals(object):
         # reconstruct the full matrix
         if (len(dm_.shape) == 1):
           full_dm = np.zeros((len(act), len(act)))
-          nMO = [(sum(self.N_bas[:i]), sum(self.N_bas[:i+1])) for i in range(len(self.N_bas))]
+          nMO = list(zip(self._nbas_cum[:-1], self._nbas_cum[1:]))
           j = 0
           k = 0
           for i,nbas in zip(nMO, self.N_bas):
@@ -848,8 +912,8 @@ class Orbitals(object):
         act_l = new_MO_l
         act_r = new_MO_r
       else:
-        new_MO_l = deepcopy(self.base_MO[0])
-        new_MO_r = deepcopy(self.base_MO[0])
+        new_MO_l = copy_MO(self.base_MO[0])
+        new_MO_r = copy_MO(self.base_MO[0])
         act_l = [o for o in new_MO_l if (o['type'] in tp_act)]
         act_r = [o for o in new_MO_r if (o['type'] in tp_act)]
       for o in new_MO_l + new_MO_r:
@@ -908,7 +972,7 @@ class Orbitals(object):
             if (np.abs(o['occup']) < 1e-6):
               o['hide'] = True
       # reorder the right NTOs to match them with the left, since they may come from different symmetries
-      resort = deepcopy(new_MO_r)
+      resort = list(new_MO_r)
       for i in np.flatnonzero(rl_sort >=0):
         resort[i] = new_MO_r[rl_sort[i]]
       new_MO_r = resort
@@ -957,17 +1021,18 @@ class Orbitals(object):
               try:
                 l, _, q, x, y, z = f.readline().split()
                 q = min(maxZ, max(0, int(q)))
-                self.centers.append({'name':l, 'Z':q, 'xyz':np.array([fortran_float(x), fortran_float(y), fortran_float(z)])*unit})
+                self.centers.append({'name':l, 'Z':q, 'xyz':fortran_floats([x, y, z])*unit})
                 num += 1
               except:
                 f.seek(save)
                 break
+            xyz = np.array([c['xyz'] for c in self.centers]).reshape(-1, 3)
           else:
-            for i in range(num):
-              l, _, q, x, y, z = f.readline().split()
-              q = min(maxZ, max(0, int(q)))
-              self.centers.append({'name':l, 'Z':q, 'xyz':np.array([fortran_float(x), fortran_float(y), fortran_float(z)])*unit})
-          self.geomcenter = (np.amin([c['xyz'] for c in self.centers], axis=0) + np.amax([c['xyz'] for c in self.centers], axis=0))/2
+            # Read all the atoms and convert all coordinates at once
+            rows = [f.readline().split() for i in range(num)]
+            xyz = fortran_floats([w for r in rows for w in r[3:6]]).reshape(-1, 3)*unit
+            self.centers = [{'name':r[0], 'Z':min(maxZ, max(0, int(r[2]))), 'xyz':x} for r,x in zip(rows, xyz)]
+          self.geomcenter = (np.amin(xyz, axis=0) + np.amax(xyz, axis=0))/2
         # Read tags for spherical shells
         elif re.search(r'\[5D\]', line, re.IGNORECASE):
           cart[2] = False
@@ -1088,15 +1153,14 @@ class Orbitals(object):
           lz = self._binom(2*lz, lz)*math.factorial(lz)//2**lz
           self.fact[i] = 1.0/np.sqrt(float(lx*ly*lz))
       # And get the indices for sorting the basis functions by center, l, m, shell
-      self.bf_sort = np.argsort(bf_id, order=('c', 'l', 'm', 's'))
+      # (lexsort uses the last key as primary)
+      self.bf_sort = np.lexsort((bf_id['s'], bf_id['m'], bf_id['l'], bf_id['c']))
       self.head = f.tell()
       self.N_bas = [len(bf_id)]
+      self.set_nbas()
       self.set_sph_c(maxl)
     # center of atoms with basis
-    nb = [isEmpty(c['basis']) for c in self.centers]
-    if (any(nb) and not all(nb)):
-      xyz = [c['xyz'] for i,c in enumerate(self.centers) if not nb[i]]
-      self.geomcenter = (np.amin(xyz, axis=0) + np.amax(xyz, axis=0))/2
+    self.set_center_arrays()
     # Reading the basis set invalidates the orbitals, if any
     self.MO = None
     self.MO_a = None
@@ -1135,66 +1199,62 @@ class Orbitals(object):
     self.MO = []
     self.MO_a = []
     self.MO_b = []
-    # Each orbital is a header with properties and a list of coefficients
+    # Each orbital is a header with properties and a list of coefficients.
+    # The rest of the file is read at once, and each orbital is located with
+    # a regular expression, so that all its coefficients are split and
+    # converted together
     with open(self.file, 'r') as f:
       f.seek(self.head)
-      next_line = None
-      while (True):
-        sym = '?'
-        ene = 0.0
-        spn = 'a'
-        occ = 0.0
-        try:
-          while(True):
-            if next_line:
-              line = next_line
-              next_line = None
-            else:
-              line = f.readline().split()
-            if '=' in line[0]:
-              line = [x.strip() for x in (''.join(line)).split('=')]
-            tag = line[0].lower()
-            if (tag == 'sym'):
-              sym = re.sub(r'^\d*', '', line[1])
-            elif (tag == 'ene'):
-              try:
-                ene = fortran_float(line[1])
-              except ValueError:
-                ene = np.nan
-            elif (tag == 'spin'):
-              spn = 'b' if (line[1] == 'Beta') else 'a'
-            elif (tag == 'occup'):
-              occ = fortran_float(line[1])
-            else:
-              next_line = line
-              break
-          cff = np.zeros(sum(self.N_bas))
-          for i in range(sum(self.N_bas)):
+      text = f.read()
+    pos = 0
+    while (True):
+      sym = '?'
+      ene = 0.0
+      spn = 'a'
+      occ = 0.0
+      try:
+        match = moldenorb.match(text, pos)
+        head = match.group(1).split()
+        words = match.group(2).split()
+        if (not (head or words)):
+          break
+        pos = match.end()
+        for line in match.group(1).splitlines():
+          line = line.split()
+          if (not line):
+            continue
+          if '=' in line[0]:
+            line = [x.strip() for x in (''.join(line)).split('=')]
+          tag = line[0].lower()
+          if (tag == 'sym'):
+            sym = re.sub(r'^\d*', '', line[1])
+          elif (tag == 'ene'):
             try:
-              if next_line:
-                line = next_line
-                next_line = None
-              else:
-                line = f.readline().split()
-              n, c = line
-              cff[int(n)-1] = fortran_float(c)
+              ene = fortran_float(line[1])
             except ValueError:
-              next_line = line
-              break
-          # Save the orbital as alpha or beta
-          if (spn == 'b'):
-            self.MO_b.append({'ene':ene, 'occup':occ, 'sym':sym, 'type':'?', 'coeff':self.fact*cff})
-          else:
-            self.MO_a.append({'ene':ene, 'occup':occ, 'sym':sym, 'type':'?', 'coeff':self.fact*cff})
-        except:
-          break
+              ene = np.nan
+          elif (tag == 'spin'):
+            spn = 'b' if (line[1] == 'Beta') else 'a'
+          elif (tag == 'occup'):
+            occ = fortran_float(line[1])
+        # Coefficient lines are pairs of index and value
+        cff = np.zeros(self._nbas_total)
+        if (words):
+          cff[np.array(words[0::2], dtype=int)-1] = fortran_floats(words[1::2])
+        # Save the orbital as alpha or beta
+        if (spn == 'b'):
+          self.MO_b.append({'ene':ene, 'occup':occ, 'sym':sym, 'type':'?', 'coeff':self.fact*cff})
+        else:
+          self.MO_a.append({'ene':ene, 'occup':occ, 'sym':sym, 'type':'?', 'coeff':self.fact*cff})
+      except:
+        break
     # Build the list of irreps from the orbitals
     self.irrep = []
     for o in self.MO_a + self.MO_b:
       if (o['sym'] not in self.irrep):
         self.irrep.append(o['sym'])
     if (not self.MO_b):
-      self.MO = deepcopy(self.MO_a)
+      self.MO = self.MO_a
       self.MO_a = []
 
   # Read molecular orbitals from an InpOrb file
@@ -1203,7 +1263,6 @@ class Orbitals(object):
       return 'Current file is not HDF5'
     self.file = infile
     self.inporb = 0
-    fortrannums = re.compile(r'-?\d*\.\d*[EeDd][+-]\d*(?!\.)')
     sections = {}
     with open(infile, 'r') as f:
       line = f.readline()
@@ -1221,7 +1280,7 @@ class Orbitals(object):
       desymmetrized = False
       if (not np.array_equal(N_bas, self.N_bas)):
         # Allow files with desymmetrized orbitals (e.g. NTOrb.SO)
-        if ((len(N_bas) == 1) and (N_bas[0] == sum(self.N_bas))):
+        if ((len(N_bas) == 1) and (N_bas[0] == self._nbas_total)):
           desymmetrized = True
           irrep = ['?']
         else:
@@ -1229,12 +1288,13 @@ class Orbitals(object):
       # Clear orbitals and decide whether or not beta orbitals will be read
       self.MO = [{} for i in range(sum(nMO))]
       if (uhf):
-        self.MO_b = deepcopy(self.MO)
+        self.MO_b = [{} for i in range(sum(nMO))]
       else:
         self.MO_a = []
         self.MO_b = []
-      ii = [sum(N_bas[:i]) for i in range(len(N_bas))]
-      jj = [sum(nMO[:i]) for i in range(len(nMO))]
+      nbas = int(np.sum(N_bas))
+      ii = np.concatenate(([0], np.cumsum(N_bas)))[:-1]
+      jj = np.concatenate(([0], np.cumsum(nMO)))[:-1]
       # Read until EOF
       while (line != ''):
         # Find next section
@@ -1245,86 +1305,51 @@ class Orbitals(object):
         if (line.startswith('#ORB')):
           sections['ORB'] = True
           line = '\n'
+          # Fill a matrix with all the coefficients, one row per orbital
+          coeff_a = np.zeros((len(self.MO), nbas))
           for i,j,b,n,s in zip(ii, jj, N_bas, nMO, irrep):
+            coeff_a[j:j+n,i:i+b] = read_fortran_blocks(f, n, b)
             for orb in self.MO[j:j+n]:
               orb['sym'] = s
-              orb['coeff'] = np.zeros(sum(N_bas))
-              cff = []
-              f.readline()
-              while (len(cff) < b):
-                line = f.readline()
-                if (re.search(r'\.[^ ]*\.', line)):
-                  cff.extend(fortrannums.findall(line))
-                else:
-                  cff.extend(line.split())
-              orb['coeff'][i:i+b] = [fortran_float(c) for c in cff]
         elif (line.startswith('#UORB')):
           sections['UORB'] = True
           line = '\n'
           if (uhf):
+            coeff_b = np.zeros((len(self.MO_b), nbas))
             for i,j,b,n,s in zip(ii, jj, N_bas, nMO, irrep):
-              for orb in self.MO_b[j:j+b]:
+              coeff_b[j:j+n,i:i+b] = read_fortran_blocks(f, n, b)
+              for orb in self.MO_b[j:j+n]:
                 orb['sym'] = s
-                orb['coeff'] = np.zeros(sum(N_bas))
-                cff = []
-                f.readline()
-                while (len(cff) < b):
-                  line = f.readline()
-                  if (re.search(r'\.[^ ]*\.', line)):
-                    cff.extend(fortrannums.findall(line))
-                  else:
-                    cff.extend(line.split())
-                orb['coeff'][i:i+b] = [fortran_float(c) for c in cff]
         # Read the occupations
         elif (line.startswith('#OCC')):
           sections['OCC'] = True
           line = '\n'
           f.readline()
           occ = []
-          for i,b,n in zip(jj, N_bas, nMO):
-            while (len(occ) < i+n):
-              line = f.readline()
-              if (re.search(r'\.[^ ]*\.', line)):
-                occ.extend(fortrannums.findall(line))
-              else:
-                occ.extend(line.split())
+          for n in nMO:
+            occ.extend(read_fortran_numbers(f, n))
         elif (line.startswith('#UOCC')):
           sections['UOCC'] = True
           line = '\n'
           if (uhf):
             f.readline()
-            for i,b,n in zip(jj, N_bas, nMO):
-              while (len(occ) < len(self.MO)+i+n):
-                line = f.readline()
-                if (re.search(r'\.[^ ]*\.', line)):
-                  occ.extend(fortrannums.findall(line))
-                else:
-                  occ.extend(line.split())
+            for n in nMO:
+              occ.extend(read_fortran_numbers(f, n))
         # Read the energies
         elif (line.startswith('#ONE')):
           sections['ONE'] = True
           line = '\n'
           f.readline()
           ene = []
-          for i,b,n in zip(jj, N_bas, nMO):
-            while (len(ene) < i+n):
-              line = f.readline()
-              if (re.search(r'\.[^ ]*\.', line)):
-                ene.extend(fortrannums.findall(line))
-              else:
-                ene.extend(line.split())
+          for n in nMO:
+            ene.extend(read_fortran_numbers(f, n))
         elif (line.startswith('#UONE')):
           sections['UONE'] = True
           line = '\n'
           if (uhf):
             f.readline()
-            for i,b,n in zip(jj, N_bas, nMO):
-              while (len(ene) < len(self.MO)+i+n):
-                line = f.readline()
-                if (re.search(r'\.[^ ]*\.', line)):
-                  ene.extend(fortrannums.findall(line))
-                else:
-                  ene.extend(line.split())
+            for n in nMO:
+              ene.extend(read_fortran_numbers(f, n))
         # Read the orbital types (same for alpha and beta)
         elif (line.startswith('#INDEX')):
           sections['INDEX'] = True
@@ -1342,13 +1367,17 @@ class Orbitals(object):
             o.pop('newtype', None)
         elif (line.startswith('#')):
           line = '\n'
-      # Desymmetrize the orbital coefficients
+      # Desymmetrize the orbital coefficients, all at once for each set
       if (sections.get('ORB')):
         if (uhf and (not sections.get('UORB'))):
           return 'No UORB section'
-        if (len(N_bas) > 1):
-          for orb in self.MO + self.MO_b:
-            orb['coeff'] = np.dot(self.mat, orb['coeff'])
+        for MO,coeff in [(self.MO, coeff_a), (self.MO_b, coeff_b if uhf else None)]:
+          if (coeff is None):
+            continue
+          if (len(N_bas) > 1):
+            coeff = np.dot(coeff, self.mat.T)
+          for orb,cf in zip(MO, coeff):
+            orb['coeff'] = cf
       else:
         return 'No ORB section'
       # Assign occupations
@@ -1356,7 +1385,7 @@ class Orbitals(object):
         if (uhf and (not sections.get('UOCC'))):
           return 'No UOCC section'
         for i,o in enumerate(self.MO + self.MO_b):
-          o['occup'] = fortran_float(occ[i])
+          o['occup'] = float(occ[i])
       else:
         for o in self.MO + self.MO_b:
           o['occup'] = 0.0
@@ -1365,7 +1394,7 @@ class Orbitals(object):
         if (uhf and (not sections.get('UONE'))):
           return 'No UONE section'
         for i,o in enumerate(self.MO + self.MO_b):
-          o['ene'] = fortran_float(ene[i])
+          o['ene'] = float(ene[i])
       else:
         for o in self.MO + self.MO_b:
           o['ene'] = 0.0
@@ -1376,7 +1405,7 @@ class Orbitals(object):
         o.pop('newtype', None)
 
     if (self.MO_b):
-      self.MO_a = deepcopy(self.MO)
+      self.MO_a = self.MO
       self.MO = []
     self.roots = [(0, 'InpOrb')]
     self.sdm = None
@@ -1384,11 +1413,36 @@ class Orbitals(object):
 
     return True
 
+  # Store the total number of basis functions and the offset of each irrep
+  def set_nbas(self):
+    self._nbas_cum = np.concatenate(([0], np.cumsum(self.N_bas))).astype(int)
+    self._nbas_total = int(self._nbas_cum[-1])
+
+  # Keep the atomic numbers and coordinates of the centers also as arrays,
+  # and set the geometric center from the atoms with basis functions
+  # (or from all atoms if none has any)
+  def set_center_arrays(self):
+    self.center_Z = np.array([c['Z'] for c in self.centers], dtype=int)
+    self.center_xyz = np.array([c['xyz'] for c in self.centers], dtype=float).reshape(-1, 3)
+    self.center_basis = np.array([not isEmpty(c['basis']) for c in self.centers], dtype=bool)
+    xyz = self.center_xyz[self.center_basis] if np.any(self.center_basis) else self.center_xyz
+    self.geomcenter = (np.amin(xyz, axis=0) + np.amax(xyz, axis=0))/2
+
+  # Coefficients (and angular functions) for each l already computed,
+  # shared by all instances, since they do not depend on the basis set
+  _sph_c_cache = {}
+  _sph_fn_cache = {}
+
   # Set the Cartesian coefficients for spherical harmonics
   def set_sph_c(self, maxl):
     # Get the coefficients for each value of l,m
     self.sph_c = []
+    self.sph_fn = []
     for l in range(maxl+1):
+      if (l in self._sph_c_cache):
+        self.sph_c.append(self._sph_c_cache[l])
+        self.sph_fn.append(self._sph_fn_cache[l])
+        continue
       s = {}
       for m in range(-l, l+1):
         s[m] = []
@@ -1401,37 +1455,64 @@ class Orbitals(object):
             c = np.sign(c)*np.sqrt(abs(c))
             if (c != 0):
               s[m].append([c, [lx, ly, lz]])
+      self._sph_c_cache[l] = s
       self.sph_c.append(s)
+      self._sph_fn_cache[l] = {m:ang_function(t) for m,t in s.items()}
+      self.sph_fn.append(self._sph_fn_cache[l])
     # Now sph_c is a list of items for each l,
     # each item is a dict for each m,
     # each item is a list for each non-zero contribution,
     # each item is a list of coefficient and [lx, ly, lz] (x**lx * y**ly * z**lz)
+    # And sph_fn has the same structure, but each item is a function that
+    # computes the angular part from the powers of x, y, z
+
+  # Compute the powers 0 to l of x,y,z by successive products, to be reused by
+  # all angular components (x**0 is just 1.0)
+  def powers(self, x, y, z, l):
+    pw = []
+    for v in [x, y, z]:
+      p = [1.0, v]
+      for i in range(2, l+1):
+        p.append(p[-1]*v)
+      pw.append(p)
+    return pw
 
   # Compute the angular component with quantum numbers l,m in an x,y,z grid
   # If cart=True, this is for a Cartesian shell
-  def ang(self, x, y, z, l, m, cart=False):
+  # Precomputed powers of x,y,z can be given in pw
+  def ang(self, x, y, z, l, m, cart=False, pw=None):
+    if (pw is None):
+      pw = self.powers(x, y, z, l)
     if (cart):
-      # For Cartesian shells, m does not actually contain m, but:
-      # m = T(ly+lz)-(lx+ly), where T(n) = n*(n+1)/2 is the nth triangular number
-      ly = int(np.floor((np.sqrt(8*(m+l)+1)-1)/2))
-      lz = m+l-ly*(ly+1)//2
-      lx = l-ly
-      ly -= lz
-      assert (lx >= 0) and (ly >= 0) and (lz >= 0)
-      c = np.sqrt(2**l)
-      ang = c * x**lx * y**ly * z**lz
+      return self.ang_cart(pw, l, m)
     else:
-      ang = 0
-      # Once sph_c has been computed, this is trivial
-      for c in self.sph_c[l][m]:
-        ang += c[0] * (x**c[1][0] * y**c[1][1] * z**c[1][2])
-    return ang
-
-  # Compute the radial component, with quantum number l, given the values of r**2 (as r2),
-  # for a list of primitive Gaussians (exponents and coefficients, as ec)
-  # and an optional power of r**2 (for contaminants)
-  def rad(self, r2, l, ec, p=0, cache=None):
-    rad = 0
+      return self.ang_sph(pw, l, m)
+
+  # Angular component for a Cartesian shell, from the powers of x,y,z
+  def ang_cart(self, pw, l, m):
+    px, py, pz = pw
+    # For Cartesian shells, m does not actually contain m, but:
+    # m = T(ly+lz)-(lx+ly), where T(n) = n*(n+1)/2 is the nth triangular number
+    ly = int(np.floor((np.sqrt(8*(m+l)+1)-1)/2))
+    lz = m+l-ly*(ly+1)//2
+    lx = l-ly
+    ly -= lz
+    assert (lx >= 0) and (ly >= 0) and (lz >= 0)
+    c = np.sqrt(2**l)
+    return c * px[lx] * py[ly] * pz[lz]
+
+  # Angular component for a spherical shell, from the powers of x,y,z
+  def ang_sph(self, pw, l, m):
+    # Once sph_fn has been computed, this is trivial
+    return self.sph_fn[l][m](*pw)
+
+  # Exponents and normalized coefficients of the (nonzero) primitives of a shell
+  def rad_coeffs(self, l, ec, p=0):
+    e, c = np.array(ec, dtype=float).reshape(-1, 2).T
+    nonzero = (c != 0.0)
+    e = e[nonzero]
+    # Fold the normalization of each primitive into the coefficients
+    c = c[nonzero]*np.power((2*e)**(3+2*l)/np.pi**3, 0.25)
     # For contaminants, the radial part is multiplied by r**(2*p)
     # and the normalization must be corrected, noting that the
     # angular part already includes a factor r**l
@@ -1440,22 +1521,65 @@ class Orbitals(object):
       for i in range(2*l+1, 2*l+4*p, 2):
         m /= i
       m = np.sqrt(float(m))
-      prad = np.power(r2, p)
-    for e,c in ec:
-      if (c != 0.0):
-        if ((cache is None) or ((e,p) not in cache)):
-          N = np.power((2*e)**(3+2*l)/np.pi**3, 0.25)
-          if (p > 0):
-            N *= m*np.power(4*e, p)
-            cch = N * np.exp(-e*r2)*prad
-          else:
-            cch = N * np.exp(-e*r2)
-          if (cache is not None):
-            cache[(e,p)] = np.copy(cch)
-        else:
-          cch = cache[(e,p)]
-        rad += c*cch
-    return rad
+      c *= m*np.power(4*e, p)
+    return e, c
+
+  # Compute the radial component, with quantum number l, given the values of r**2 (as r2),
+  # for a list of primitive Gaussians (exponents and coefficients, as ec)
+  # and an optional power of r**2 (for contaminants)
+  def rad(self, r2, l, ec, p=0):
+    e, c = self.rad_coeffs(l, ec, p)
+    shape = np.shape(r2)
+    r2 = np.reshape(r2, -1)
+    rad = np.empty_like(r2)
+    if (numba is not None):
+      _rad_kernel(r2, e, c, rad)
+    else:
+      # All primitives at once, as a matrix product, in tiles to limit the memory
+      tile = max(1, 2**20//max(1, e.size))
+      for i in range(0, r2.size, tile):
+        rad[i:i+tile] = np.dot(c, np.exp(-np.multiply.outer(e, r2[i:i+tile])))
+    # Integer powers of r**2 as repeated products
+    for i in range(p):
+      rad *= r2
+    return rad.reshape(shape)
+
+  # Compute the radial parts of several shells with the same l at once,
+  # shells is a list of [p, ec] and a list of arrays is returned.
+  # Generally contracted shells share the exponents, so each exponential
+  # is computed only once for all of them
+  # The exponents and coefficient matrix are stored with the given key,
+  # since they are needed for every block of points
+  def rads(self, r2, l, shells, key=None):
+    if (key in self._rads_coeffs):
+      e, c = self._rads_coeffs[key]
+    else:
+      coeffs = [self.rad_coeffs(l, sh[1], sh[0]) for sh in shells]
+      e = np.unique(np.concatenate([ec[0] for ec in coeffs]))
+      c = np.zeros((len(shells), e.size))
+      for k,(ek,ck) in enumerate(coeffs):
+        np.add.at(c[k], np.searchsorted(e, ek), ck)
+      if (key is not None):
+        self._rads_coeffs[key] = (e, c)
+    shape = np.shape(r2)
+    r2 = np.reshape(r2, -1)
+    rad = np.empty((len(shells), r2.size), dtype=r2.dtype)
+    if (numba is not None):
+      _rads_kernel(r2, e, c, rad)
+    else:
+      tile = max(1, 2**20//max(1, e.size))
+      for i in range(0, r2.size, tile):
+        rad[:,i:i+tile] = np.dot(c, np.exp(-np.multiply.outer(e, r2[i:i+tile])))
+    # Integer powers of r**2 by successive products, shared by all shells
+    pr2 = [1.0, r2]
+    for i in range(2, max(sh[0] for sh in shells)+1):
+      pr2.append(pr2[-1]*r2)
+    result = []
+    for k,sh in enumerate(shells):
+      if (sh[0] > 0):
+        rad[k] *= pr2[sh[0]]
+      result.append(rad[k].reshape(shape))
+    return result
 
   # Compute an atomic orbital as product of angular and radial components
   def ao(self, x, y, z, ec, l, m, p=0):
@@ -1464,119 +1588,166 @@ class Orbitals(object):
     rad = self.rad(r2, l, ec, p)
     return ang*rad
 
-  # Compute a molecular orbital, as linear combination of atomic orbitals
-  # at different centers. It can use a cache of atomic orbitals to avoid
-  # recomputing them. "spin" specifies if the coefficients will be taken
-  # from self.MO_a (alpha) or self.MO_b (beta)
-  def mo(self, n, x, y, z, spin='n', cache=None, callback=None, interrupt=False):
-    mo = np.zeros_like(x)
-    # Reorder MO coefficients
-    if (spin == 'b'):
-      MO = self.MO_b[n]
-    elif (spin == 'a'):
-      MO = self.MO_a[n]
-    else:
-      MO = self.MO[n]
-    MO = MO['coeff'][self.bf_sort]
-
-    if (callback is None):
-      actions = [True]
-    else:
-      num = 0
-      total = 0
-      actions = [False, True]
-
+  # Compute the atomic orbitals (basis functions, in bf_sort order) in an x,y,z grid,
+  # as a matrix with one row per basis function. Only the basis functions
+  # marked in "need" are computed, the other rows are left as zero.
+  # "progress" is called after each computed basis function
+  def aos(self, x, y, z, need, progress=None, interrupt=False):
+    ao = np.zeros((len(need), x.size), dtype=x.dtype)
+    table = self.bf_table()
+    # Group the needed basis functions by center, so that the loop
+    # does not go through the functions (or centers) that are not needed
+    active = OrderedDict()
+    for f in np.flatnonzero(need):
+      active.setdefault(table[f][0], []).append(f)
+    # For each center, the relative x,y,z and r**2 are different
+    for i,bfs in active.items():
+      c = self.centers[i]
+      # (computed per axis, without stacking the coordinates in a new array)
+      cx, cy, cz = c['xyz']
+      x0 = x - cx
+      y0 = y - cy
+      z0 = z - cz
+      r2 = x0*x0
+      r2 += y0*y0
+      r2 += z0*z0
+      pw = self.powers(x0, y0, z0, len(c['basis'])-1)
+      # The angular part depends only on l,m (and the shell type) and the
+      # radial part only on l and the shell, save them to reuse them
+      ang_sph = {}
+      ang_cart = {}
+      # The radial parts of all needed shells with the same l are computed together
+      shells = OrderedDict()
+      for f in bfs:
+        shells.setdefault(table[f][1], set()).add(table[f][3])
+      rad_ls = {}
+      for l,ss in shells.items():
+        ss = sorted(ss)
+        for s,rd in zip(ss, self.rads(r2, l, [c['basis'][l][s] for s in ss], key=(i, l, tuple(ss)))):
+          rad_ls[(l, s)] = rd
+      for f in bfs:
+        if (interrupt):
+          return ao
+        _, l, m, s, cart = table[f]
+        if (cart):
+          if ((l, m) not in ang_cart):
+            ang_cart[(l, m)] = self.ang_cart(pw, l, m)
+          a = ang_cart[(l, m)]
+        else:
+          if ((l, m) not in ang_sph):
+            ang_sph[(l, m)] = self.ang_sph(pw, l, m)
+          a = ang_sph[(l, m)]
+        add_ao(ao[f], 1.0, a, rad_ls[(l, s)])
+        if (progress is not None):
+          progress()
+    return ao
+
+  # Build (once) a table with the center, l, m, shell and Cartesian flag
+  # of each basis function, in the same order as the sorted coefficients
+  def bf_table(self):
+    if (self._bf_table is None):
+      table = []
+      for i,c in enumerate(self.centers):
+        for l,ll in enumerate(c['basis']):
+          # Classify the shells only once, spherical shells have m in [-l,l],
+          # Cartesian shells have the extended range [-l,l*(l+1)/2]
+          shells = [(s, (l, s) in c['cart']) for s in range(len(ll))]
+          cart_shells = [sc for sc in shells if sc[1]]
+          for m in range(-l, l+1):
+            table.extend([(i, l, m, s, cart) for s,cart in shells])
+          for m in range(l+1, l*(l+1)//2+1):
+            table.extend([(i, l, m, s, cart) for s,cart in cart_shells])
+      self._bf_table = table
+    return self._bf_table
+
+  # Compute several molecular orbitals at once, as linear combinations of atomic orbitals,
+  # "coeff" has one row per orbital, in bf_sort order. The atomic orbitals are computed
+  # only once for all orbitals and the orbitals obtained by a matrix product.
+  # It can use a cache of atomic orbitals to avoid recomputing them.
+  def mos(self, coeff, x, y, z, cache=None, callback=None, chunk=None, interrupt=False):
+    coeff = np.atleast_2d(coeff)
+    nbas = coeff.shape[1]
     npoints = x.size
+    mos = np.zeros((coeff.shape[0], npoints), dtype=x.dtype)
+    # Only compute AOs above threshold for some orbital
+    need = np.any(np.abs(coeff) > self.eps, axis=0)
     if (cache is not None):
-      chunk_size = cache.shape[1]
+      chunk_size = cache.npoints
     use_cache = (cache is not None) and (chunk_size >= npoints)
+    # AOs that are not yet in the cache
+    if (use_cache):
+      compute = need & ~cache.present
+    else:
+      compute = need
 
-    for compute in actions:
-      f = 0
-      # For each center, the relative x,y,z and r**2 are different
-      for c in self.centers:
-        x0, y0, z0 = [None]*3
-        r2 = None
-        # For each center, l and shell we have different radial parts
-        for l,ll in enumerate(c['basis']):
-          # Since all shells are computed for each m value, but the radial
-          # part does not depend on m, we will save the radial part for
-          # each shell to reuse it. This is a dict and not a list because
-          # some shells could be skipped altogether
-          rad_l = {}
-          prim_cache = {}
-          # For each center, l and m we have different angular parts
-          # (the range includes both spherical and Cartesian indices)
-          #for m in range(-l, l*(l+1)+1):
-          for m in range(-l, l*(l+1)//2+1):
-            ao_ang = None
-            cart = None
-            # Now each shell is an atomic orbital (basis function)
-            for s,p in enumerate(ll):
-              if (interrupt):
-                return mo
-              # Skip when out of range for spherical shells
-              # Also invalidate the angular part if for some reason
-              # there is a mixture of types among shells
-              if ((l, s) in c['cart']):
-                if (cart is False):
-                  ang = None
-                cart = True
-              else:
-                if (cart is True):
-                  ang = None
-                cart = False
-                if (m > l):
-                  continue
-              # Only compute if above threshold
-              if (abs(MO[f]) > self.eps):
-                if (compute):
-                  if (callback is not None):
-                    num += 1
-                    callback('Computing: {0}/{1} ...'.format(num, total))
-                  # The AO contribution is either in the cache
-                  # or we compute it now
-                  if (not use_cache or np.isnan(cache[f,0])):
-                    # Compute relative coordinates if not done yet
-                    if (x0 is None):
-                      x0, y0, z0 = [x, y, z] - c['xyz'][:, np.newaxis]
-                      r2 = x0**2 + y0**2 + z0**2
-                    # Compute angular part if not done yet
-                    if (ao_ang is None):
-                      ao_ang = self.ang(x0, y0, z0, l, m, cart=cart)
-                    # Compute radial part if not done yet
-                    if (s not in rad_l):
-                      rad_l[s] = self.rad(r2, l, p[1], p[0], cache=prim_cache)
-                    cch = ao_ang*rad_l[s]
-                    # Save in the cache if enabled
-                    if (use_cache):
-                      cache[f][0:cch.size] = np.copy(cch)
-                  elif (use_cache):
-                    cch = cache[f][0:x.size]
-                  # Add the AO contribution to the MO
-                  mo += MO[f]*cch
-                else:
-                  total += 1
-              f += 1
+    # The grid is processed in tiles, so that the intermediate arrays
+    # (coordinates, powers, angular and radial parts, AOs) stay small
+    tile = max(2**8, min(2**16, 2**22//max(1, nbas)))
+    ntiles = max(1, (npoints+tile-1)//tile)
+    if (callback is None):
+      progress = None
+    else:
+      if (chunk is None):
+        text = 'Computing: {0}/{1} ...'
+      else:
+        text = 'Computing: {{0}}/{{1}} (chunk {0}/{1}) ...'.format(*chunk)
+      total = np.count_nonzero(compute)*ntiles
+      num = [0]
+      def progress():
+        num[0] += 1
+        callback(text.format(num[0], total))
+
+    for start in range(0, npoints, tile):
+      end = min(start+tile, npoints)
+      ao = self.aos(x[start:end], y[start:end], z[start:end], compute, progress=progress, interrupt=interrupt)
+      if (interrupt):
+        return mos
+      # Save in and read from the cache if enabled
+      if (use_cache):
+        block = cache.data[start:end]
+        block[:,compute] = ao[compute].T
+        ao[need] = block[:,need].T
+      mos[:,start:end] = np.dot(coeff[:,need], ao[need])
+    # The computed AOs are only marked as present once all tiles are done
     if (use_cache):
+      cache.present[compute] = True
       cache.flush()
-    return mo
+    return mos
+
+  # Get the coefficients of the alpha, beta or natural orbitals (spin='a', 'b', 'n')
+  # as a contiguous matrix with one row per orbital, in bf_sort order.
+  # The matrix is kept as long as the list of orbitals is the same object
+  def sorted_coeff(self, spin='n'):
+    if (spin == 'b'):
+      MO = self.MO_b
+    elif (spin == 'a'):
+      MO = self.MO_a
+    else:
+      MO = self.MO
+    saved = self._sorted_coeff.get(spin)
+    if ((saved is None) or (saved[0] is not MO) or (len(saved[1]) != len(MO))):
+      C = np.array([o['coeff'] for o in MO]).reshape(len(MO), -1)
+      self._sorted_coeff[spin] = (MO, np.ascontiguousarray(C[:,self.bf_sort]))
+    return self._sorted_coeff[spin][1]
+
+  # Compute a molecular orbital, as linear combination of atomic orbitals
+  # at different centers. It can use a cache of atomic orbitals to avoid
+  # recomputing them. "spin" specifies if the coefficients will be taken
+  # from self.MO_a (alpha) or self.MO_b (beta)
+  def mo(self, n, x, y, z, spin='n', cache=None, callback=None, interrupt=False):
+    MO = self.sorted_coeff(spin)[n]
+    return self.mos(MO, x, y, z, cache, callback=callback, interrupt=interrupt)[0]
 
   # Compute electron density as sum of square of (natural) orbitals times occupation.
   # It can use a cache for MO evaluation and a mask to select only some orbitals.
+  # All the selected orbitals are computed at once from the same atomic orbitals.
   def dens(self, x, y, z, cache=None, precomp=None, mask=None, spin=False, trans=False, callback=None, interrupt=False):
     dens = np.zeros_like(x)
-    if (self.MO_b):
-      MO_list = [j for i in zip_longest(self.MO_a, self.MO_b) for j in i]
+    unrestricted = bool(self.MO_b)
+    if (unrestricted):
+      MO_list = self.MO_a + self.MO_b
     else:
       MO_list = self.MO
-    # If there is a callback function, we take two passes,
-    # one to count the orbitals and another to actually compute them
-    if (callback is None):
-      actions = [True]
-    else:
-      total = 0
-      actions = [False, True]
 
     # Try to build a unique identifier for this density
     # and see if has already been computed (and stored)
@@ -1595,68 +1766,71 @@ class Orbitals(object):
         denslist.append(pos)
         return dens
 
-    npoints = x.size
-    if (cache is not None):
-      chunk_size = cache.shape[1]
+    # Index, spin (0: alpha or natural, 1: beta) and occupation of each orbital,
+    # in the order used by the mask: alternated alpha and beta orbitals
+    if (unrestricted):
+      na = len(self.MO_a)
+      nb = len(self.MO_b)
+      idx = np.repeat(np.arange(max(na, nb)), 2)
+      spn = np.tile([0, 1], max(na, nb))
+      keep = np.where(spn == 0, idx < na, idx < nb)
+      idx = idx[keep]
+      spn = spn[keep]
+      occ = mo_column(MO_list, 'occup')[idx+na*spn]
+      if (spin):
+        occ[spn == 1] *= -1
+      if (trans):
+        idx = idx[spn == 0]
+        occ = occ[spn == 0]
+        spn = spn[spn == 0]
     else:
-      chunk_size = npoints
-    chunk_list = list(range(0, npoints, chunk_size))
+      idx = np.arange(len(MO_list))
+      spn = np.zeros_like(idx)
+      occ = mo_column(MO_list, 'occup')
+    # Select the orbitals that contribute
+    select = np.abs(occ) > self.eps
+    if (mask is not None):
+      n = min(len(mask), len(select))
+      select[:n] &= np.array(mask[:n], dtype=bool)
+    idx = idx[select]
+    spn = spn[select]
+    occ = occ[select]
+    self.total_occup = np.sum(occ)
+    if (len(occ) > 0):
+      if (trans):
+        coeff = np.vstack((self.sorted_coeff('a')[idx], self.sorted_coeff('b')[idx]))
+      elif (unrestricted):
+        coeff = np.vstack((self.sorted_coeff('a')[idx[spn == 0]], self.sorted_coeff('b')[idx[spn == 1]]))
+        occ = np.concatenate((occ[spn == 0], occ[spn == 1]))
+      else:
+        coeff = self.sorted_coeff('n')[idx]
 
-    for compute in actions:
-      if (compute):
-        do_list = chunk_list
-        tot = 0
+      npoints = x.size
+      if (cache is not None):
+        chunk_size = cache.npoints
       else:
-        do_list = [0]
-      for chunk,start in enumerate(do_list):
-        if ((cache is not None) and (len(do_list) > 1)):
-          cache[:,0] = np.nan
+        # Limit the size of the array of orbitals
+        chunk_size = max(2**12, 2**24//coeff.shape[0])
+      chunk_list = list(range(0, npoints, chunk_size))
+
+      for chunk,start in enumerate(chunk_list):
+        if (interrupt):
+          return dens
+        if ((cache is not None) and (len(chunk_list) > 1)):
+          cache.reset()
         x_ = x[start:start+chunk_size]
         y_ = y[start:start+chunk_size]
         z_ = z[start:start+chunk_size]
-        num = 0
-        j = 0
-        for i,orb in enumerate(MO_list):
-          if (interrupt):
-            return dens
-          if (orb is None):
-            continue
-          f = 1.0
-          if (MO_list is self.MO):
-            # Natural orbitals
-            ii = i
-            s = 'n'
-          else:
-            # Add alternated alpha and beta orbitals
-            ii = i//2
-            if (i%2 == 0):
-              s = 'a'
-            else:
-              s = 'b'
-              if (spin):
-                f = -1.0
-          if (trans and (s == 'b')):
-            continue
-          if ((mask is None) or (len(mask) < j+1) or mask[j]):
-            occup = f*orb['occup']
-            if (abs(occup) > self.eps):
-              if (compute):
-                if (callback is not None):
-                  num += 1
-                  if (len(do_list) > 1):
-                    callback('Computing: {0}/{1} (chunk {2}/{3}) ...'.format(num, total, chunk+1, len(do_list)))
-                  else:
-                    callback('Computing: {0}/{1} ...'.format(num, total))
-                if (trans):
-                  dens[start:start+chunk_size] += occup*(self.mo(ii, x_, y_, z_, 'a', cache, interrupt=interrupt)*
-                                                         self.mo(ii, x_, y_, z_, 'b', cache, interrupt=interrupt))
-                else:
-                  dens[start:start+chunk_size] += occup*self.mo(ii, x_, y_, z_, s, cache, interrupt=interrupt)**2
-                tot += occup
-              else:
-                total += 1
-          j += 1
-    self.total_occup = tot
+        if ((cache is not None) and (len(chunk_list) > 1)):
+          chunk_id = (chunk+1, len(chunk_list))
+        else:
+          chunk_id = None
+        mos = self.mos(coeff, x_, y_, z_, cache, callback=callback, chunk=chunk_id, interrupt=interrupt)
+        if (trans):
+          n = len(occ)
+          dens[start:start+chunk_size] = np.dot(occ, mos[:n]*mos[n:])
+        else:
+          dens[start:start+chunk_size] = np.dot(occ, mos**2)
     # Save the computed density in the oldest slot
     if (precomp is not None):
       denslist = precomp[0]
@@ -1675,49 +1849,50 @@ class Orbitals(object):
     box[:,1] /= n[1]-1
     box[:,2] /= n[2]-1
     g = np.linalg.inv(np.dot(box.T, box))
-    data = -2*field*(sum(np.diag(g)))
-    for i in range(n[0]):
-      if ((i == 0) or (i == n[0]-1)):
-        data[i,:,:] = None
-      else:
-        data[i,:,:] += (field[i-1,:,:]+field[i+1,:,:])*g[0,0]
-        if (abs(g[0,1]) > 0):
-          for j in range(1, n[1]-1):
-            data[i,j,:] += (field[i-1,j-1,:]+field[i+1,j+1,:]-field[i-1,j+1,:]-field[i+1,j-1,:])*g[0,1]/2
-        if (abs(g[0,2]) > 0):
-          for k in range(1, n[2]-1):
-            data[i,:,k] += (field[i-1,:,k-1]+field[i+1,:,k+1]-field[i-1,:,k+1]-field[i+1,:,k-1])*g[0,2]/2
-    for j in range(n[1]):
-      if ((j == 0) or (j == n[1]-1)):
-        data[:,j,:] = None
-      else:
-        data[:,j,:] += (field[:,j-1,:]+field[:,j+1,:])*g[1,1]
-        if (abs(g[1,2]) > 0):
-          for k in range(1, n[2]-1):
-            data[:,j,k] += (field[:,j-1,k-1]+field[:,j+1,k+1]-field[:,j-1,k+1]-field[:,j+1,k-1])*g[1,2]/2
-    for k in range(n[2]):
-      if ((k == 0) or (k == n[2]-1)):
-        data[:,:,k] = None
-      else:
-        data[:,:,k] += (field[:,:,k-1]+field[:,:,k+1])*g[2,2]
-    return data.flatten()
-
-  # Returns binomial coefficient as a fraction
-  # Easy overflow for large arguments, but we are interested in relatively small arguments
+    # Slices for the inner points and their neighbours in each direction,
+    # the points at the edges are left undefined
+    c = slice(1, -1)
+    m = slice(None, -2)
+    p = slice(2, None)
+    data = np.full(n, np.nan)
+    # The grid is processed in slabs along the first axis (with one extra
+    # plane on each side), so that the temporary arrays stay small
+    step = max(1, 2**18//max(1, n[1]*n[2]))
+    for i in range(1, n[0]-1, step):
+      j = min(i+step, n[0]-1)
+      f = field[i-1:j+1]
+      lap = -2*f[c,c,c]*(sum(np.diag(g)))
+      lap += (f[m,c,c]+f[p,c,c])*g[0,0]
+      lap += (f[c,m,c]+f[c,p,c])*g[1,1]
+      lap += (f[c,c,m]+f[c,c,p])*g[2,2]
+      # Cross terms for non-orthogonal axes
+      if (abs(g[0,1]) > 0):
+        lap += (f[m,m,c]+f[p,p,c]-f[m,p,c]-f[p,m,c])*g[0,1]/2
+      if (abs(g[0,2]) > 0):
+        lap += (f[m,c,m]+f[p,c,p]-f[m,c,p]-f[p,c,m])*g[0,2]/2
+      if (abs(g[1,2]) > 0):
+        lap += (f[c,m,m]+f[c,p,p]-f[c,m,p]-f[c,p,m])*g[1,2]/2
+      data[i:j,c,c] = lap
+    return data.ravel()
+
+  # Returns binomial coefficient as an integer (0 if out of range)
+  # The results are saved, since the same few values are requested many times
+  _binom_cache = {}
   def _binom(self, n, k):
-    mk = max(k,n-k)
-    try:
-      binom = Fraction(math.factorial(n), math.factorial(mk))
-      binom *= Fraction(1, math.factorial(n-mk))
-      assert (binom.denominator == 1)
-    except ValueError:
-      binom = Fraction(0, 1)
+    if ((n, k) in self._binom_cache):
+      return self._binom_cache[(n, k)]
+    if ((k < 0) or (k > n)):
+      binom = 0
+    else:
+      binom = math.factorial(n)//(math.factorial(k)*math.factorial(n-k))
+    self._binom_cache[(n, k)] = binom
     return binom
 
   # Computes the coefficient for x^lx * y^ly * z^lz in the expansion of
   # the real solid harmonic S(l,±m) = C * r^l*(Y(l,m)±Y(l,-m))
   # Since the coefficients are square roots of rational numbers, this
   # returns the square of the coefficient as a fraction, with its sign
+  # All intermediate values are integers, only the final result is a fraction
   #
   # See:
   # Transformation between Cartesian and pure spherical harmonic Gaussians
@@ -1735,17 +1910,19 @@ class Orbitals(object):
       return Fraction(0, 1)
     c = 0
     for i in range((l-am)//2+1):
-      c += self._binom(l, i) * self._binom(i, j) * Fraction(math.factorial(2*l-2*i), math.factorial(l-am-2*i)) * (-1)**i
+      # (2l-2i)!/(l-|m|-2i)! is always an integer
+      c += self._binom(l, i) * self._binom(i, j) * (math.factorial(2*l-2*i)//math.factorial(l-am-2*i)) * (-1)**i
     if (c == 0):
       return Fraction(0, 1)
     c_sph = c
     c = 0
-    for k in range(j+1):
-      c += self._binom(j, k) * self._binom(am, lx-2*k) * 1j**(am-lx+2*k)
+    # Real (m>=0) or imaginary (m<0) part of i**p, with p = |m|-lx+2k
     if (m >= 0):
-      c = int(np.real(c))
+      ipow = [1, 0, -1, 0]
     else:
-      c = int(np.imag(c))
+      ipow = [0, 1, 0, -1]
+    for k in range(j+1):
+      c += self._binom(j, k) * self._binom(am, lx-2*k) * ipow[(am-lx+2*k) % 4]
     if (c == 0):
       return Fraction(0, 1)
     c_sph *= c
@@ -1757,18 +1934,16 @@ class Orbitals(object):
       lm = 1
     else:
       lm = 2
-    c = Fraction(math.factorial(l-am), math.factorial(l+am))
-    c *= Fraction(lm, math.factorial(l))
-    c *= Fraction(1, math.factorial(2*l))
-    c_sph *= c
-    return c_sph
+    num = c_sph * lm * math.factorial(l-am)
+    den = math.factorial(l+am) * math.factorial(l) * math.factorial(2*l)
+    return Fraction(num, den)
 
   # Writes a new HDF5 file
   def write_hdf5(self, filename):
     attrs = {}
     dsets = {}
     # First read stuff to be copied
-    with h5py.File(self.h5file, 'r') as fi:
+    with open_h5(self.h5file) as fi:
       for a in ['NSYM', 'NBAS', 'NPRIM', 'IRREP_LABELS', 'NATOMS_ALL', 'NATOMS_UNIQUE']:
         if (a in fi.attrs):
           attrs[a] = fi.attrs[a]
@@ -1789,26 +1964,18 @@ class Orbitals(object):
       if (len(self.N_bas) > 1):
         sym = np.linalg.inv(self.mat)
       else:
-        sym = np.eye(sum(self.N_bas))
+        sym = np.eye(self._nbas_total)
       # Write orbital data from current orbitals
       # (could be loaded from InpOrb, selected from a root and/or have modified types)
       uhf = len(self.MO_b) > 0
-      nMO = [(sum(self.N_bas[:i]), sum(self.N_bas[:i+1])) for i in range(len(self.N_bas))]
+      nMO = list(zip(self._nbas_cum[:-1], self._nbas_cum[1:]))
       if (uhf):
-        cff = []
-        for i,j in nMO:
-          for k in range(i,j):
-            cff.extend(np.dot(sym, self.MO_a[k]['coeff'])[i:j])
-        fo.create_dataset('MO_ALPHA_VECTORS', data=cff)
-        cff = []
-        for i,j in nMO:
-          for k in range(i,j):
-            cff.extend(np.dot(sym, self.MO_b[k]['coeff'])[i:j])
-        fo.create_dataset('MO_BETA_VECTORS', data=cff)
-        fo.create_dataset('MO_ALPHA_OCCUPATIONS', data=[o['occup'] for o in self.MO_a])
-        fo.create_dataset('MO_BETA_OCCUPATIONS', data=[o['occup'] for o in self.MO_b])
-        fo.create_dataset('MO_ALPHA_ENERGIES', data=[o['ene'] for o in self.MO_a])
-        fo.create_dataset('MO_BETA_ENERGIES', data=[o['ene'] for o in self.MO_b])
+        self._write_vectors(fo, 'MO_ALPHA_VECTORS', self.MO_a, sym, nMO)
+        self._write_vectors(fo, 'MO_BETA_VECTORS', self.MO_b, sym, nMO)
+        fo.create_dataset('MO_ALPHA_OCCUPATIONS', data=mo_column(self.MO_a, 'occup'))
+        fo.create_dataset('MO_BETA_OCCUPATIONS', data=mo_column(self.MO_b, 'occup'))
+        fo.create_dataset('MO_ALPHA_ENERGIES', data=mo_column(self.MO_a, 'ene'))
+        fo.create_dataset('MO_BETA_ENERGIES', data=mo_column(self.MO_b, 'ene'))
         tp = [o.get('newtype', o['type']) for o in self.MO_a]
         for i,o in enumerate(self.MO_a):
           if (tp[i] == '?'):
@@ -1820,13 +1987,9 @@ class Orbitals(object):
             tp[i] = 'I' if (o['occup'] > 0.5) else 'S'
         fo.create_dataset('MO_BETA_TYPEINDICES', data=np.array(tp, dtype=np.string_))
       if (len(self.MO) > 0):
-        cff = []
-        for i,j in nMO:
-          for k in range(i,j):
-            cff.extend(np.dot(sym, self.MO[k]['coeff'])[i:j])
-        fo.create_dataset('MO_VECTORS', data=cff)
-        fo.create_dataset('MO_OCCUPATIONS', data=[o['occup'] for o in self.MO])
-        fo.create_dataset('MO_ENERGIES', data=[o['ene'] for o in self.MO])
+        self._write_vectors(fo, 'MO_VECTORS', self.MO, sym, nMO)
+        fo.create_dataset('MO_OCCUPATIONS', data=mo_column(self.MO, 'occup'))
+        fo.create_dataset('MO_ENERGIES', data=mo_column(self.MO, 'ene'))
         tp = [o.get('newtype', o['type']) for o in self.MO]
         for i,o in enumerate(self.MO):
           if (tp[i] == '?'):
@@ -1835,6 +1998,23 @@ class Orbitals(object):
       if (self.notes is not None):
         fo.create_dataset('Pegamoid_notes', data=np.array(self.notes, dtype=np.string_))
 
+  # Writes the symmetrized orbital coefficients as a dataset, one symmetry block
+  # at a time, the dataset is chunked (about 1 MB) and compressed with the
+  # standard deflate filter, so it can be read by any HDF5 library
+  def _write_vectors(self, fo, name, MO, sym, nMO):
+    total = sum([(j-i)**2 for i,j in nMO])
+    if (total > 0):
+      dset = fo.create_dataset(name, shape=(total,), dtype=float, chunks=(min(total, 2**17),), compression='gzip', shuffle=True)
+    else:
+      dset = fo.create_dataset(name, shape=(0,), dtype=float)
+    n = 0
+    for i,j in nMO:
+      if (j > i):
+        # each row contains the coefficients of one orbital in this symmetry
+        block = np.dot(np.array([o['coeff'] for o in MO[i:j]]), sym[i:j].T)
+        dset[n:n+block.size] = block.flatten()
+        n += block.size
+
   # Creates an InpOrb file from scratch
   def create_inporb(self, filename, MO=None):
     nMO = OrderedDict()
@@ -1854,9 +2034,10 @@ class Orbitals(object):
     if (len(self.N_bas) > 1):
       sym = np.linalg.inv(self.mat)
     else:
-      sym = np.eye(sum(self.N_bas))
-    nMO = [(sum(self.N_bas[:i]), sum(self.N_bas[:i+1])) for i in range(len(self.N_bas))]
-    with open(filename, 'w') as f:
+      sym = np.eye(self._nbas_total)
+    nMO = list(zip(self._nbas_cum[:-1], self._nbas_cum[1:]))
+    # Use a large buffer, and join the text of each section before writing
+    with open(filename, 'w', buffering=2**20) as f:
       f.write('#INPORB 2.2\n')
       f.write('#INFO\n')
       f.write('* File generated by {0} from {1}\n'.format(__name__, self.file))
@@ -1870,45 +2051,89 @@ class Orbitals(object):
       f.write('#ORB\n')
       for s,(i,j) in enumerate(nMO):
         for k in range(i,j):
-          f.write('* ORBITAL{0:5d}{1:5d}\n'.format(s+1, k-i+1))
           cff = alphaMO[k]['coeff']
           cff = np.dot(sym, cff)
           cff = wrap_list(cff[i:j], 5, '{:21.14E}', sep=' ')
-          f.write(' ' + '\n '.join(cff) + '\n')
+          f.write('* ORBITAL{0:5d}{1:5d}\n {2}\n'.format(s+1, k-i+1, '\n '.join(cff)))
       if (uhf):
         f.write('#UORB\n')
         for s,(i,j) in enumerate(nMO):
           for k in range(i,j):
-            f.write('* ORBITAL{0:5d}{1:5d}\n'.format(s+1, k-i+1))
             cff = self.MO_b[k]['coeff']
             cff = np.dot(sym, cff)
             cff = wrap_list(cff[i:j], 5, '{:21.14E}', sep=' ')
-            f.write(' ' + '\n '.join(cff) + '\n')
+            f.write('* ORBITAL{0:5d}{1:5d}\n {2}\n'.format(s+1, k-i+1, '\n '.join(cff)))
       f.write('#OCC\n')
       f.write('* OCCUPATION NUMBERS\n')
+      text = []
+      values = mo_column(alphaMO, 'occup')
       for i,j in nMO:
-        occ = wrap_list([o['occup'] for o in alphaMO[i:j]], 5, '{:21.14E}', sep=' ')
-        f.write(' ' + '\n '.join(occ) + '\n')
+        occ = wrap_list(values[i:j], 5, '{:21.14E}', sep=' ')
+        text.append(' ' + '\n '.join(occ) + '\n')
+      f.write(''.join(text))
       if (uhf):
         f.write('#UOCC\n')
         f.write('* Beta OCCUPATION NUMBERS\n')
+        text = []
+        values = mo_column(self.MO_b, 'occup')
         for i,j in nMO:
-          occ = wrap_list([o['occup'] for o in self.MO_b[i:j]], 5, '{:21.14E}', sep=' ')
-          f.write(' ' + '\n '.join(occ) + '\n')
+          occ = wrap_list(values[i:j], 5, '{:21.14E}', sep=' ')
+          text.append(' ' + '\n '.join(occ) + '\n')
+        f.write(''.join(text))
       f.write('#ONE\n')
       f.write('* ONE ELECTRON ENERGIES\n')
+      text = []
+      values = mo_column(alphaMO, 'ene')
       for i,j in nMO:
-        ene = wrap_list([o['ene'] for o in alphaMO[i:j]], 10, '{:11.4E}', sep=' ')
-        f.write(' ' + '\n '.join(ene) + '\n')
+        ene = wrap_list(values[i:j], 10, '{:11.4E}', sep=' ')
+        text.append(' ' + '\n '.join(ene) + '\n')
+      f.write(''.join(text))
       if (uhf):
         f.write('#UONE\n')
         f.write('* Beta ONE ELECTRON ENERGIES\n')
+        text = []
+        values = mo_column(self.MO_b, 'ene')
         for i,j in nMO:
-          ene = wrap_list([o['ene'] for o in self.MO_b[i:j]], 10, '{:11.4E}', sep=' ')
-          f.write(' ' + '\n '.join(ene) + '\n')
-      f.write('#INDEX\n')
-      f.write('\n'.join(index))
-      f.write('\n')
+          ene = wrap_list(values[i:j], 10, '{:11.4E}', sep=' ')
+          text.append(' ' + '\n '.join(ene) + '\n')
+        f.write(''.join(text))
+      f.write('#INDEX\n' + '\n'.join(index) + '\n')
+
+#===============================================================================
+# Class for a disk cache of atomic orbitals computed in a grid.
+# The values are stored in single precision in a memory-mapped file, with one
+# row per grid point (so that a range of points, for all basis functions, is a
+# contiguous block), and a separate flag says which columns are complete.
+
+class AOCache(object):
+
+  def __init__(self, filename, nbas, npoints, dtype='float32'):
+    self.filename = filename
+    self.data = np.memmap(filename, dtype=dtype, mode='w+', shape=(npoints, nbas))
+    self.present = np.zeros(nbas, dtype=bool)
+
+  @property
+  def nbas(self):
+    return self.data.shape[1]
+
+  @property
+  def npoints(self):
+    return self.data.shape[0]
+
+  @property
+  def nbytes(self):
+    return self.data.nbytes
+
+  # Mark all basis functions as not computed
+  def reset(self):
+    self.present[:] = False
+
+  def flush(self):
+    self.data.flush()
+
+  def close(self):
+    self.data._mmap.close()
+    del self.data
 
 #===============================================================================
 # Class for orbitals (or any other function) defined as values in a predefined
@@ -1925,49 +2150,41 @@ class Grid(object):
     self.file = gridfile
     self.type = ftype
     self.wf = None
+    # Open file handle and memory map, kept across calls to mo()
+    self._fh = None
+    self._mm = None
+    # Recently read orbitals, and a lock to use the file from the prefetch thread
+    self._mo_cache = OrderedDict()
+    self._lock = threading.Lock()
     if (ftype == 'cube'):
       self.read_cube_header()
     elif (ftype == 'luscus'):
       self.read_luscus_header()
     elif (ftype == 'grid'):
       self.read_grid_header()
+    # Grid shape and number of points, used for every orbital read
+    self._shape = tuple(self.ngrid)
+    self._num = int(np.prod(self.ngrid))
 
   # Read grid header from a Cube format
   def read_cube_header(self):
     self.irrep = ['z']
     with open(self.file, 'rb') as f:
       self.title = str(f.readline().decode('ascii')).strip()
-      # Read title and grid origin
+      # Read title
       title = str(f.readline().decode('ascii')).strip()
-      n, x, y, z = f.readline().split()
-      num = int(n)
-      translate = np.array([fortran_float(x), fortran_float(y), fortran_float(z)])
-      # Read grid sizes and transformation matrix
-      n, x, y, z = f.readline().split()
-      ngridx = int(n)
-      self.transform[0,0] = fortran_float(x)
-      self.transform[1,0] = fortran_float(y)
-      self.transform[2,0] = fortran_float(z)
-      self.transform[0,3] = translate[0]
-      n, x, y, z = f.readline().split()
-      ngridy = int(n)
-      self.transform[0,1] = fortran_float(x)
-      self.transform[1,1] = fortran_float(y)
-      self.transform[2,1] = fortran_float(z)
-      self.transform[1,3] = translate[1]
-      n, x, y, z = f.readline().split()
-      ngridz= int(n)
-      self.transform[0,2] = fortran_float(x)
-      self.transform[1,2] = fortran_float(y)
-      self.transform[2,2] = fortran_float(z)
-      self.transform[2,3] = translate[2]
-      # Read geometry
-      self.centers = []
-      for i in range(abs(num)):
-        q, _, x, y, z = str(f.readline().decode('ascii')).split()
-        q = min(maxZ, max(0, int(q)))
-        self.centers.append({'name':'{0}'.format(i), 'Z':q, 'xyz':np.array([fortran_float(x), fortran_float(y), fortran_float(z)])})
-      self.geomcenter = (np.amin([c['xyz'] for c in self.centers], axis=0) + np.amax([c['xyz'] for c in self.centers], axis=0))/2
+      # Read number of atoms and grid origin, then grid sizes and transformation
+      # matrix (the columns of the matrix are the three axes and the origin)
+      rows = [str(f.readline().decode('ascii')).split() for i in range(4)]
+      num, ngridx, ngridy, ngridz = [int(r[0]) for r in rows]
+      M = fortran_floats([w for r in rows for w in r[1:4]]).reshape(4, 3)
+      self.transform[:3,:3] = M[1:].T
+      self.transform[:3,3] = M[0]
+      # Read geometry, all coordinates are converted at once
+      rows = [str(f.readline().decode('ascii')).split() for i in range(abs(num))]
+      xyz = fortran_floats([w for r in rows for w in r[2:5]]).reshape(-1, 3)
+      self.centers = [{'name':'{0}'.format(i), 'Z':min(maxZ, max(0, int(r[0]))), 'xyz':x} for i,(r,x) in enumerate(zip(rows, xyz))]
+      self.geomcenter = (np.amin(xyz, axis=0) + np.amax(xyz, axis=0))/2
       # Compute full volume size
       self.ngrid = [ngridx, ngridy, ngridz]
       self.orig = np.array([0.0, 0.0, 0.0])
@@ -1986,8 +2203,6 @@ class Grid(object):
         self.MO = [{'label':title, 'ene':0.0, 'occup':0.0, 'type':'?', 'sym':'z'}]
       self.MO_a = []
       self.MO_b = []
-      # Number of values in the innermost loop (ngridz * nMO)
-      self.lrec = self.nMO*self.ngrid[2]
       # Save the position after the header
       self.head = f.tell()
 
@@ -1996,13 +2211,12 @@ class Grid(object):
     with open(self.file, 'rb') as f:
       f.readline()
       self.title = str(f.readline().decode('ascii')).strip()
-      # Read the geometry
+      # Read the geometry, all coordinates are converted at once
       num = int(f.readline().split()[1])
-      self.centers = []
-      for i in range(num):
-        l, x, y, z = str(f.readline().decode('ascii')).split()
-        self.centers.append({'name':l, 'Z':name_to_Z(l), 'xyz':np.array([fortran_float(x), fortran_float(y), fortran_float(z)])})
-      self.geomcenter = (np.amin([c['xyz'] for c in self.centers], axis=0) + np.amax([c['xyz'] for c in self.centers], axis=0))/2
+      rows = [str(f.readline().decode('ascii')).split() for i in range(num)]
+      xyz = fortran_floats([w for r in rows for w in r[1:4]]).reshape(-1, 3)
+      self.centers = [{'name':r[0], 'Z':name_to_Z(r[0]), 'xyz':x} for r,x in zip(rows, xyz)]
+      self.geomcenter = (np.amin(xyz, axis=0) + np.amax(xyz, axis=0))/2
       # Read number of orbitals and block size
       f.readline()
       f.readline()
@@ -2016,22 +2230,11 @@ class Grid(object):
       f.readline()
       # Read grid definition and transform matrix
       self.ngrid = [int(i)+1 for i in f.readline().split()[1:]]
-      translate = np.array([fortran_float(i) for i in f.readline().split()[1:]])
-      x, y, z = (fortran_float(i) for i in f.readline().split()[1:])
-      self.transform[0,0] = x
-      self.transform[1,0] = y
-      self.transform[2,0] = z
-      self.transform[0,3] = translate[0]
-      x, y, z = (fortran_float(i) for i in f.readline().split()[1:])
-      self.transform[0,1] = x
-      self.transform[1,1] = y
-      self.transform[2,1] = z
-      self.transform[1,3] = translate[1]
-      x, y, z = (fortran_float(i) for i in f.readline().split()[1:])
-      self.transform[0,2] = x
-      self.transform[1,2] = y
-      self.transform[2,2] = z
-      self.transform[2,3] = translate[2]
+      # The columns of the matrix are the three axes and the origin
+      rows = [str(f.readline().decode('ascii')).split()[1:] for i in range(4)]
+      M = fortran_floats([w for r in rows for w in r]).reshape(4, 3)
+      self.transform[:3,:3] = M[1:].T
+      self.transform[:3,3] = M[0]
       self.orig = np.array([0.0, 0.0, 0.0])
       self.end = np.array([1.0, 1.0, 1.0])
       # Read and parse orbital names
@@ -2039,20 +2242,20 @@ class Grid(object):
       self.MO_a = []
       self.MO_b = []
       self.irrep = []
+      irreps = set()
       for i in range(self.nMO):
         name = str(f.readline().decode('ascii'))
-        match = re.match(r'\s*GridName=\s+(\d+)\s+(\d+)\s+(.+)\s+\((.+)\)\s+(\w)s*', name)
+        match = gridname.match(name)
         if (match):
           self.MO.append({'ene':fortran_float(match.group(3)), 'occup':fortran_float(match.group(4)), 'type':match.group(5).upper(), 'sym':match.group(1), 'num':int(match.group(2)), 'idx':i})
-          if (self.MO[-1]['sym'] not in self.irrep):
-            self.irrep.append(self.MO[-1]['sym'])
         else:
           name = ' '.join(name.split()[1:])
           self.MO.append({'label':name, 'ene':-np.inf, 'occup':0.0, 'type':'?', 'sym':'z', 'num':0, 'idx':i})
-          if ('z' not in self.irrep):
-            self.irrep.append('z')
+        if (self.MO[-1]['sym'] not in irreps):
+          irreps.add(self.MO[-1]['sym'])
+          self.irrep.append(self.MO[-1]['sym'])
       # Sort the orbitals by symmetry and number
-      self.MO.sort(key=lambda x: (x['sym'], x['num']))
+      self.MO.sort(key=itemgetter('sym', 'num'))
       # Save the position after the header
       self.head = f.tell()
       # Find inporb location
@@ -2072,12 +2275,11 @@ class Grid(object):
       # Read the geometry
       num = int(f.readline())
       f.readline()
-      atom = []
-      self.centers = []
-      for i in range(num):
-        l, x, y, z = str(f.readline().decode('ascii')).split()
-        self.centers.append({'name':l, 'Z':name_to_Z(l), 'xyz':np.array([fortran_float(x), fortran_float(y), fortran_float(z)])*angstrom})
-      self.geomcenter = (np.amin([c['xyz'] for c in self.centers], axis=0) + np.amax([c['xyz'] for c in self.centers], axis=0))/2
+      # All coordinates are converted at once
+      rows = [str(f.readline().decode('ascii')).split() for i in range(num)]
+      xyz = fortran_floats([w for r in rows for w in r[1:4]]).reshape(-1, 3)*angstrom
+      self.centers = [{'name':r[0], 'Z':name_to_Z(r[0]), 'xyz':x} for r,x in zip(rows, xyz)]
+      self.geomcenter = (np.amin(xyz, axis=0) + np.amax(xyz, axis=0))/2
       # Read number of orbitals and block size
       f.readline()
       data = f.readline().split()
@@ -2086,22 +2288,11 @@ class Grid(object):
       f.readline()
       # Read grid definition and transform matrix
       self.ngrid = [int(i) for i in f.readline().split()[1:]]
-      translate = np.array([fortran_float(i) for i in f.readline().split()[1:]])
-      x, y, z = (fortran_float(i) for i in f.readline().split()[1:])
-      self.transform[0,0] = x
-      self.transform[1,0] = y
-      self.transform[2,0] = z
-      self.transform[0,3] = translate[0]
-      x, y, z = (fortran_float(i) for i in f.readline().split()[1:])
-      self.transform[0,1] = x
-      self.transform[1,1] = y
-      self.transform[2,1] = z
-      self.transform[1,3] = translate[1]
-      x, y, z = (fortran_float(i) for i in f.readline().split()[1:])
-      self.transform[0,2] = x
-      self.transform[1,2] = y
-      self.transform[2,2] = z
-      self.transform[2,3] = translate[2]
+      # The columns of the matrix are the three axes and the origin
+      rows = [str(f.readline().decode('ascii')).split()[1:] for i in range(4)]
+      M = fortran_floats([w for r in rows for w in r]).reshape(4, 3)
+      self.transform[:3,:3] = M[1:].T
+      self.transform[:3,3] = M[0]
       self.orig = np.array([0.0, 0.0, 0.0])
       self.end = np.array([1.0, 1.0, 1.0])
       self.orboff = int(f.readline().split()[2])
@@ -2110,97 +2301,206 @@ class Grid(object):
       self.MO_a = []
       self.MO_b = []
       self.irrep = []
+      irreps = set()
       for i in range(self.nMO):
         name = str(f.readline().decode('ascii'))
-        match = re.match(r'\s*GridName=\s*(.+)\s*sym=\s*(\d+)\s*index=\s*(\d+)\s*Energ=\s*(.+)\s*occ=\s*(.+)\s*type=\s*(\w)\s*', name)
+        match = luscusname.match(name)
         if (match):
           self.MO.append({'ene':fortran_float(match.group(4)), 'occup':fortran_float(match.group(5)), 'type':match.group(6).upper(), 'sym':match.group(2), 'num':int(match.group(3)), 'idx':i})
-          if (self.MO[-1]['sym'] not in self.irrep):
-            self.irrep.append(self.MO[-1]['sym'])
         else:
           name = ' '.join(name.split()[1:])
           self.MO.append({'label':name, 'ene':-np.inf, 'occup':0.0, 'type':'?', 'sym':'z', 'num':0, 'idx':i})
-          if ('z' not in self.irrep):
-            self.irrep.append('z')
+        if (self.MO[-1]['sym'] not in irreps):
+          irreps.add(self.MO[-1]['sym'])
+          self.irrep.append(self.MO[-1]['sym'])
       # Sort the orbitals by symmetry and number
-      self.MO.sort(key=lambda x: (x['sym'], x['num']))
+      self.MO.sort(key=itemgetter('sym', 'num'))
       f.readline()
       # Save the position after the header
       self.head = f.tell()
-      # Find inporb location
+      # Layout of the binary data: full blocks of bsize points (for each orbital),
+      # and a last partial block
+      num = int(np.prod(self.ngrid))
+      self._nfull = num//self.bsize
+      self._rest = num-self._nfull*self.bsize
+      # Find inporb location, skipping directly over the binary data
+      # (nMO values for each grid point, 8 bytes each)
+      f.seek(self.head + 8*self.nMO*num)
       loc = f.tell()
-      line = f.readline()
+      line = f.readline().decode('ascii', errors='replace')
       while (line != ''):
-        loc = f.tell()
-        line = f.readline().decode('ascii', errors='replace')
         if (line.startswith('#INPORB')):
           self.inporb = loc
           break
+        loc = f.tell()
+        line = f.readline().decode('ascii', errors='replace')
+
+  # Return the data file positioned after the header, the file is kept open
+  def _data_file(self):
+    if (self._fh is None):
+      self._fh = open(self.file, 'rb')
+    self._fh.seek(self.head)
+    return self._fh
 
-  # Read and return precomputed MO values
+  # Close the open file and memory map, if any
+  def close(self):
+    if (self._fh is not None):
+      self._fh.close()
+      self._fh = None
+    self._mm = None
+
+  def __del__(self):
+    self.close()
+
+  # Maximum number of orbitals kept in memory
+  mo_cache_size = 8
+
+  # Return precomputed MO values, recently read orbitals are kept in memory
   def mo(self, n, x, y, z, spin=None, cache=None, callback=None, interrupt=False):
+    with self._lock:
+      if (n in self._mo_cache):
+        self._mo_cache.move_to_end(n)
+        return self._mo_cache[n]
+      vol = self._read_mo(n, interrupt=interrupt)
+      if (not interrupt):
+        self._mo_cache[n] = vol
+        while (len(self._mo_cache) > self.mo_cache_size):
+          self._mo_cache.popitem(last=False)
+    return vol
+
+  # Read some orbitals in a background thread, if they are not already in memory
+  # (for example, the orbitals next to the one being displayed)
+  def prefetch(self, orbs):
+    orbs = [n for n in orbs if ((0 <= n < len(self.MO)) and (n not in self._mo_cache))]
+    if (not orbs):
+      return
+    def read():
+      for n in orbs:
+        try:
+          self.mo(n, None, None, None)
+        except Exception:
+          pass
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+
+  # Read and return precomputed MO values from the file
+  def _read_mo(self, n, interrupt=False):
     if (self.type == 'cube'):
-      # In Cube format, the nesting is x:y:z:MO
-      vol = np.empty(tuple(self.ngrid))
-      with open(self.file, 'rb') as f:
-        f.seek(self.head)
-        data = []
-        for i in range(self.ngrid[0]):
-          for j in range(self.ngrid[1]):
-            while len(data) < self.lrec:
-              if (interrupt):
-                return vol
-              data.extend(f.readline().split())
-            vol[i,j,:] = [fortran_float(k) for k in data[n:self.lrec:self.nMO]]
-            data = data[self.lrec:]
+      # In Cube format, the nesting is x:y:z:MO, so the values for one
+      # orbital are every nMO numbers, line breaks do not matter.
+      # Read the data in large chunks of lines (to limit the memory used
+      # for text) and convert only the needed values in each chunk
+      f = self._data_file()
+      num = self._num*self.nMO
+      data = []
+      # Index of the first number in the chunk
+      pos = 0
+      while (pos < num):
+        if (interrupt):
+          return np.empty(self._shape)
+        lines = f.readlines(2**24)
+        if (not lines):
+          break
+        nums = b' '.join(lines).decode('ascii', errors='replace').split()
+        first = (n-pos) % self.nMO
+        data.append(fortran_floats(nums[first:num-pos:self.nMO]))
+        pos += len(nums)
+      vol = np.reshape(np.concatenate(data), self._shape)
     elif (self.type == 'grid'):
       # In Grid format, the nesting is MO:x:y:z, but divided in
-      # blocks of length bsize
+      # blocks of length bsize, each orbital in a block has a title line
+      # and then one value per line.
+      # The lines of other orbitals are consumed without processing them
+      # (a zero-length deque is a fast sink), and the lines of the
+      # selected orbital in each block are converted together
       data = []
       norb = self.MO[n]['idx']
-      with open(self.file, 'rb') as f:
-        f.seek(self.head)
-        num = np.prod(self.ngrid)
-        while (len(data) < num):
-          lb = min(self.bsize, num-len(data))
-          for o in range(self.nMO):
-            f.readline()
-            for i in range(lb):
-              if (interrupt):
-                vol = np.resize(data, num)
-                return np.reshape(vol, tuple(self.ngrid))
-              if (o == norb):
-                data.append(fortran_float(f.readline()))
-              else:
-                f.readline()
-      vol = np.reshape(data, tuple(self.ngrid))
+      f = self._data_file()
+      num = self._num
+      done = 0
+      while (done < num):
+        if (interrupt):
+          vol = np.resize(np.concatenate(data) if data else [], num)
+          return np.reshape(vol, self._shape)
+        lb = min(self.bsize, num-done)
+        deque(islice(f, norb*(lb+1)+1), maxlen=0)
+        block = list(islice(f, lb))
+        # A truncated file would otherwise give a confusing reshape error
+        if (len(block) < lb):
+          error = 'Unexpected end of data in {0}'.format(self.file)
+          raise Exception(error)
+        data.append(fortran_floats(b' '.join(block).decode('ascii', errors='replace').split()))
+        deque(islice(f, (self.nMO-norb-1)*(lb+1)), maxlen=0)
+        done += lb
+      vol = np.reshape(np.concatenate(data), self._shape)
     elif (self.type == 'luscus'):
       # In Luscus format, the nesting is MO:x:y:z, but divided in
-      # blocks of length bsize, and in binary format
-      data = []
+      # blocks of length bsize, and in binary format.
+      # The data is mapped in memory and the orbital is taken by slicing:
+      # all full blocks together as a 3D array (block, MO, point), and
+      # then the last partial block
+      if (interrupt):
+        return np.empty(self._shape)
       norb = self.MO[n]['idx']
-      with open(self.file, 'rb') as f:
-        f.seek(self.head)
-        num = np.prod(self.ngrid)
-        while (len(data) < num):
-          if (interrupt):
-            vol = np.resize(data, num)
-            return np.reshape(vol, tuple(self.ngrid))
-          lb = min(self.bsize, num-len(data))
-          lbb = lb*struct.calcsize('d')
-          f.seek(norb*lbb, 1)
-          data.extend(list(struct.unpack(lb*'d', f.read(lbb))))
-          f.seek((self.nMO-norb-1)*lbb, 1)
-      vol = np.reshape(data, tuple(self.ngrid))
+      nfull = self._nfull
+      rest = self._rest
+      full = nfull*self.nMO*self.bsize
+      if (self._mm is None):
+        self._mm = np.memmap(self.file, dtype='d', mode='r', offset=self.head, shape=(full+self.nMO*rest,))
+      mm = self._mm
+      data = [mm[:full].reshape(nfull, self.nMO, self.bsize)[:,norb,:].ravel()]
+      if (rest > 0):
+        data.append(mm[full+norb*rest:full+(norb+1)*rest])
+      vol = np.reshape(np.concatenate(data), self._shape)
     return vol
 
 #===============================================================================
 
+# Minimum absolute value of an array, ignoring NaN. The array is processed
+# in blocks, to avoid a temporary copy of the whole array
+def nanmin_abs(data, block=2**20):
+  data = np.ravel(data)
+  minval = np.nan
+  for i in range(0, data.size, block):
+    # fmin ignores NaN
+    minval = np.fmin(minval, np.nanmin(np.abs(data[i:i+block])))
+  return minval
+
+#===============================================================================
+
+# Extract a numeric property of a list of orbitals as an array
+def mo_column(MO, key):
+  return np.array(list(map(itemgetter(key), MO)), dtype=float)
+
+#===============================================================================
+
+# Copy a list of orbitals, the coefficient arrays are never modified in place,
+# so they can be shared instead of duplicated
+def copy_MO(MO):
+  return [o.copy() for o in MO]
+
+#===============================================================================
+
+# Open an HDF5 file for reading, with a large chunk cache, so that chunked
+# datasets are not decompressed again on each partial access
+def open_h5(filename):
+  try:
+    return h5py.File(filename, 'r', rdcc_nbytes=256*1024**2, rdcc_nslots=100003, rdcc_w0=0.75)
+  except TypeError:
+    # older h5py versions do not accept these parameters
+    return h5py.File(filename, 'r')
+
+#===============================================================================
+
 # Create an index section from alpha and beta orbitals
 def create_index(MO, MO_b, nMO, old=None):
   index = []
   error = None
-  orbs = list(zip_longest(MO, MO_b))
+  # Group the alpha and beta pairs by symmetry in a single pass
+  orbs = {}
+  for oa,ob in zip_longest(MO, MO_b):
+    orbs.setdefault(oa['sym'], []).append((oa, ob))
   for si,s in enumerate(nMO):
     index.append('* 1234567890')
     if (old is not None):
@@ -2208,11 +2508,7 @@ def create_index(MO, MO_b, nMO, old=None):
     else:
       types = nMO[s]*[' ']
     # Try to merge different alpha and beta types
-    i = -1
-    for oa,ob in orbs:
-      if (oa['sym'] != s):
-        continue
-      i += 1
+    for i,(oa,ob) in enumerate(orbs.get(s, [])):
       tpa = oa.get('newtype', oa['type']).lower()
       if (ob is None):
         tp = tpa
@@ -2243,29 +2539,29 @@ def create_index(MO, MO_b, nMO, old=None):
 
 #===============================================================================
 
+# Element symbols, in order of atomic number, and reverse lookup
+element_symbols = [                                              'X',
+  'H',  'HE', 'LI', 'BE', 'B',  'C',  'N',  'O',  'F',  'NE',
+  'NA', 'MG', 'AL', 'SI', 'P',  'S',  'CL', 'AR', 'K',  'CA',
+  'SC', 'TI', 'V',  'CR', 'MN', 'FE', 'CO', 'NI', 'CU', 'ZN',
+  'GA', 'GE', 'AS', 'SE', 'BR', 'KR', 'RB', 'SR', 'Y',  'ZR',
+  'NB', 'MO', 'TC', 'RU', 'RH', 'PD', 'AG', 'CD', 'IN', 'SN',
+  'SB', 'TE', 'I',  'XE', 'CS', 'BA', 'LA', 'CE', 'PR', 'ND',
+  'PM', 'SM', 'EU', 'GD', 'TB', 'DY', 'HO', 'ER', 'TM', 'YB',
+  'LU', 'HF', 'TA', 'W',  'RE', 'OS', 'IR', 'PT', 'AU', 'HG',
+  'TL', 'PB', 'BI', 'PO', 'AT', 'RN', 'FR', 'RA', 'AC', 'TH',
+  'PA', 'U',  'NP', 'PU', 'AM', 'CM', 'BK', 'CF', 'ES', 'FM',
+  'MD', 'NO', 'LR', 'RF', 'DB', 'SG', 'BH', 'HS', 'MT', 'DS',
+  'RG', 'CN', 'NH', 'FL', 'MC', 'LV', 'TS', 'OG'
+]
+symbol_to_Z = {s:i for i,s in enumerate(element_symbols)}
+
 # Return atomic number from atomic name
 def name_to_Z(name):
-  symbol = [                                              'X',
-    'H',  'HE', 'LI', 'BE', 'B',  'C',  'N',  'O',  'F',  'NE',
-    'NA', 'MG', 'AL', 'SI', 'P',  'S',  'CL', 'AR', 'K',  'CA',
-    'SC', 'TI', 'V',  'CR', 'MN', 'FE', 'CO', 'NI', 'CU', 'ZN',
-    'GA', 'GE', 'AS', 'SE', 'BR', 'KR', 'RB', 'SR', 'Y',  'ZR',
-    'NB', 'MO', 'TC', 'RU', 'RH', 'PD', 'AG', 'CD', 'IN', 'SN',
-    'SB', 'TE', 'I',  'XE', 'CS', 'BA', 'LA', 'CE', 'PR', 'ND',
-    'PM', 'SM', 'EU', 'GD', 'TB', 'DY', 'HO', 'ER', 'TM', 'YB',
-    'LU', 'HF', 'TA', 'W',  'RE', 'OS', 'IR', 'PT', 'AU', 'HG',
-    'TL', 'PB', 'BI', 'PO', 'AT', 'RN', 'FR', 'RA', 'AC', 'TH',
-    'PA', 'U',  'NP', 'PU', 'AM', 'CM', 'BK', 'CF', 'ES', 'FM',
-    'MD', 'NO', 'LR', 'RF', 'DB', 'SG', 'BH', 'HS', 'MT', 'DS',
-    'RG', 'CN', 'NH', 'FL', 'MC', 'LV', 'TS', 'OG'
-  ]
   s = '{0:2.2}'.format(name.upper())
   if (s[1] not in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
     s = s[0]
-  try:
-    return symbol.index(s)
-  except:
-    return 0
+  return symbol_to_Z.get(s, 0)
 
 #===============================================================================
 
@@ -2300,14 +2596,11 @@ def set_opacity_wrapper(obj, val):
 
 # Return a list, each element containing at most n items each with format f
 def wrap_list(data, n, f, sep=''):
-  text = []
-  ini = 0
-  while ini < len(data):
-    end = min(ini+n, len(data))
-    fmt = sep.join([f]*(end-ini))
-    text.append(fmt.format(*data[ini:end]))
-    ini = end
-  return text
+  # Format each value once with the bound format method,
+  # then join them in lines of n values
+  fmt = f.format
+  items = [fmt(d) for d in data]
+  return [sep.join(items[i:i+n]) for i in range(0, len(items), n)]
 
 #===============================================================================
 
@@ -2364,6 +2657,129 @@ def fortran_float(num):
   num = fortfixexp.sub(r'\1e\2', num)
   return float(num)
 
+# Convert a list of Fortran-formatted numbers to an array of floats in one go,
+# d/D exponents are translated directly, the regular expression is only
+# needed if some exponent has no letter
+fortrantrans = str.maketrans('dD', 'eE')
+def fortran_floats(nums):
+  text = ' '.join(nums).translate(fortrantrans)
+  try:
+    return np.array(text.split(), dtype=float)
+  except ValueError:
+    text = fortfixexp.sub(r'\1e\2', text)
+    return np.array(text.split(), dtype=float)
+
+# Read n Fortran-formatted numbers from a file, spanning as many lines as needed.
+# After the first line, the lines that should complete the block (if all have
+# the same number of values) are read and converted together.
+# The numbers may be written without spaces between them (if they fill their fields)
+fortrannums = re.compile(r'-?\d*\.\d*[EeDd][+-]\d*(?!\.)')
+fortjoined = re.compile(r'\.\S*\.')
+def split_fortran_numbers(text):
+  if (fortjoined.search(text)):
+    return fortrannums.findall(text)
+  return text.split()
+
+def read_fortran_numbers(f, n):
+  nums = []
+  nlines = 1
+  total = 0
+  while (len(nums) < n):
+    text = ''.join([f.readline() for i in range(nlines)])
+    if (text == ''):
+      break
+    total += nlines
+    nums.extend(split_fortran_numbers(text))
+    # Estimate the remaining lines from the numbers per line so far
+    if (len(nums) > 0):
+      nlines = max(1, -(-(n-len(nums))*total//len(nums)))
+  return fortran_floats(nums[:n])
+
+# Read n blocks of b Fortran-formatted numbers, each preceded by a header line,
+# as an (n, b) array. The lines taken by the first block are assumed for all
+# the others, which are then read and converted together; if the headers are
+# not where expected, go back and read the blocks one by one
+def read_fortran_blocks(f, n, b):
+  data = np.zeros((n, b))
+  if (n == 0):
+    return data
+  f.readline()
+  lines = []
+  nums = []
+  while (len(nums) < b):
+    line = f.readline()
+    if (line == ''):
+      break
+    lines.append(line)
+    nums.extend(split_fortran_numbers(line))
+  data[0,:len(nums[:b])] = fortran_floats(nums[:b])
+  if (n == 1):
+    return data
+  k = len(lines)+1
+  pos = f.tell()
+  lines = [f.readline() for i in range((n-1)*k)]
+  if (all(l.startswith('*') for l in lines[::k])):
+    del lines[::k]
+    nums = split_fortran_numbers(''.join(lines))
+    if (len(nums) == (n-1)*b):
+      data[1:] = fortran_floats(nums).reshape((n-1, b))
+      return data
+  f.seek(pos)
+  for i in range(1, n):
+    f.readline()
+    data[i] = read_fortran_numbers(f, b)
+  return data
+
+# Build a function that computes an angular part as a polynomial of x, y, z,
+# given a list of coefficients and powers [c, [lx, ly, lz]], from the precomputed
+# powers of x, y, z. The function is generated as a single expression,
+# so that there is no loop over the terms
+def ang_function(terms):
+  expr = []
+  for c, powers in terms:
+    factors = [repr(float(c))]
+    for v,n in zip(['px', 'py', 'pz'], powers):
+      if (n > 0):
+        factors.append('{0}[{1}]'.format(v, n))
+    expr.append('*'.join(factors))
+  if (not expr):
+    expr = ['0.0']
+  code = 'def f(px, py, pz):\n  return {0}\n'.format(' + '.join(expr))
+  namespace = {}
+  exec(code, namespace)
+  return namespace['f']
+
+# Orbital labels in Grid and Luscus files
+gridname = re.compile(r'\s*GridName=\s+(\d+)\s+(\d+)\s+(.+)\s+\((.+)\)\s+(\w)s*')
+luscusname = re.compile(r'\s*GridName=\s*(.+)\s*sym=\s*(\d+)\s*index=\s*(\d+)\s*Energ=\s*(.+)\s*occ=\s*(.+)\s*type=\s*(\w)\s*')
+
+# An orbital in a Molden file: header lines (starting with a letter, or blank)
+# followed by coefficient lines (index and value)
+moldenorb = re.compile(r'((?:[ \t]*(?:[A-Za-z][^\n]*)?\n)*)((?:[ \t]*\d+[ \t]+\S+[ \t]*(?:\n|$))*)')
+
+# Copy text from buf and then file f to file fo, in large blocks, until a line
+# starting with one of the tags (except the first line of buf) is found.
+# Return the rest of the text read (starting with the tag) and the tag found
+def copy_until(f, fo, buf, tags, size=2**16):
+  keep = max([len(t) for t in tags])
+  # All tags are searched for in a single pass
+  pattern = re.compile('\n(' + '|'.join([re.escape(t) for t in tags]) + ')')
+  while True:
+    m = pattern.search(buf)
+    if (m):
+      i = m.start()
+      fo.write(buf[:i+1])
+      return buf[i+1:], m.group(1)
+    # Keep the end, in case a tag is split between blocks
+    if (len(buf) > keep):
+      fo.write(buf[:-keep])
+      buf = buf[-keep:]
+    more = f.read(size)
+    if (not more):
+      fo.write(buf)
+      return '', None
+    buf += more
+
 #===============================================================================
 
 # Fix for VTK bug 17715
@@ -2474,6 +2890,12 @@ class ComputeVolume(Worker):
     print_func = self.parent().setStatus
     orb = self.parent().orbital
     x, y, z = numpy_support.vtk_to_numpy(self.parent().xyz.GetOutput().GetPoints().GetData()).T
+    # Single precision is enough for display, and halves the memory traffic
+    # (the AO cache is single precision too), except for the Laplacian,
+    # which is computed by finite differences. The grid is not used for
+    # precomputed orbitals
+    if ((orb != -2) and (not self.parent().isGrid)):
+      x, y, z = np.array([x, y, z], dtype=np.float32)
     if (self.parent().MO is self.parent().orbitals.MO_b):
       spin = 'b'
     elif (self.parent().MO is self.parent().orbitals.MO_a):
@@ -2538,6 +2960,9 @@ class ComputeVolume(Worker):
       self.data = data
     else:
       self.data = self.parent().orbitals.mo(orb-1, x, y, z, spin, self.cache, callback=print_func, interrupt=self.parent().interrupt)
+      # Read in advance the next and previous orbitals in the file
+      if (self.parent().isGrid):
+        self.parent().orbitals.prefetch([orb, orb-2])
 
 
 class ScrollMessageBox(QDialog):
@@ -2759,13 +3184,13 @@ class TakeScreenshot(QDialog):
   # have to use a trick similar to that used in ParaView: get images with black
   # and white backgrounds and figure out the transparency from their difference
   def set_transparency(self, white_background, black_background):
-    wdata = numpy_support.vtk_to_numpy(white_background.GetPointData().GetScalars()).astype(float)
-    bdata = numpy_support.vtk_to_numpy(black_background.GetPointData().GetScalars()).astype(float)
-    if (bdata.shape[1] == 3):
-      output = np.hstack((bdata, np.ones((bdata.shape[0], 1))))
-    else:
-      output = deepcopy(bdata)
-    alpha = 255 - (wdata[:,0:3].max(1) - bdata[:,0:3].max(1))
+    wdata = numpy_support.vtk_to_numpy(white_background.GetPointData().GetScalars())
+    bdata = numpy_support.vtk_to_numpy(black_background.GetPointData().GetScalars())
+    # Fill the RGB channels of a preallocated RGBA array, the alpha channel
+    # is computed below, so there is no need to stack or copy the input
+    output = np.empty((bdata.shape[0], 4))
+    output[:,0:3] = bdata[:,0:3]
+    alpha = 255 - (wdata[:,0:3].max(1).astype(float) - bdata[:,0:3].max(1))
     mask = alpha > 0
     output[:,0:3] *= 255/np.where(mask[:,np.newaxis], alpha[:,np.newaxis], 255)
     output[:,3] = alpha
@@ -3116,6 +3541,9 @@ class MainWindow(QMainWindow):
     self._cache_file = None
     self._dens_cache = None
     self._dens_list = None
+    self._cache_key = None
+    self._sym_numbers = None
+    self._orbital_pos = {}
     self._timestamp = time.time()
 
   def init_properties(self):
@@ -3448,13 +3876,11 @@ class MainWindow(QMainWindow):
     # value properties
     self.isovalueSlider.setRange(0, 1000)
     self.opacitySlider.setRange(0, 100)
-    self.typeButtonGroup.addButton(self.frozenButton, 1)
-    self.typeButtonGroup.addButton(self.inactiveButton, 2)
-    self.typeButtonGroup.addButton(self.RAS1Button, 3)
-    self.typeButtonGroup.addButton(self.RAS2Button, 4)
-    self.typeButtonGroup.addButton(self.RAS3Button, 5)
-    self.typeButtonGroup.addButton(self.secondaryButton, 6)
-    self.typeButtonGroup.addButton(self.deletedButton, 7)
+    # Map each orbital type to its button, the id in the group is the position
+    self.typeButtons = OrderedDict([('F', self.frozenButton), ('I', self.inactiveButton), ('1', self.RAS1Button), ('2', self.RAS2Button),
+                                    ('3', self.RAS3Button), ('S', self.secondaryButton), ('D', self.deletedButton)])
+    for i,b in enumerate(self.typeButtons.values()):
+      self.typeButtonGroup.addButton(b, i+1)
     self.directionButtonGroup.addButton(self.downButton, vtk.vtkStreamTracer.BACKWARD)
     self.directionButtonGroup.addButton(self.bothButton, vtk.vtkStreamTracer.BOTH)
     self.directionButtonGroup.addButton(self.upButton, vtk.vtkStreamTracer.FORWARD)
@@ -3648,13 +4074,8 @@ class MainWindow(QMainWindow):
     self.naturalShortcut = QShortcut(QKeySequence('E'), self)
     self.naturalShortcut.activated.connect(self.select_natural)
     self.sortedBox.setShortcut('Shift+S')
-    self.frozenButton.setShortcut('F')
-    self.inactiveButton.setShortcut('I')
-    self.RAS1Button.setShortcut('1')
-    self.RAS2Button.setShortcut('2')
-    self.RAS3Button.setShortcut('3')
-    self.secondaryButton.setShortcut('S')
-    self.deletedButton.setShortcut('D')
+    for tp,b in self.typeButtons.items():
+      b.setShortcut(tp)
     self.resetButton.setShortcut('0')
     self.increaseIsovalueShortcut = QShortcut(QKeySequence('+'), self)
     self.increaseIsovalueShortcut.activated.connect(self.increase_isovalue)
@@ -3728,6 +4149,16 @@ class MainWindow(QMainWindow):
     self.isovalueSlider.valueChanged.connect(self.isovalueSlider_changed)
     self.isovalueBox.textChanged.connect(partial(self.isovalueBox_changed, False))
     self.isovalueBox.editingFinished.connect(partial(self.isovalueBox_changed, True))
+    self.isovalueTimer = QTimer(self)
+    self.isovalueTimer.setSingleShot(True)
+    self.isovalueTimer.setInterval(30)
+    self.isovalueTimer.timeout.connect(self.update_contour)
+    # Delay the grid rebuild until control returns to the event loop, so that
+    # consecutive changes to the box, transformation or points only rebuild it once
+    self.gridTimer = QTimer(self)
+    self.gridTimer.setSingleShot(True)
+    self.gridTimer.setInterval(0)
+    self.gridTimer.timeout.connect(self.build_grid)
     self.opacitySlider.valueChanged.connect(self.opacitySlider_changed)
     self.opacityBox.textChanged.connect(partial(self.opacityBox_changed, False))
     self.opacityBox.editingFinished.connect(partial(self.opacityBox_changed, True))
@@ -3885,6 +4316,11 @@ class MainWindow(QMainWindow):
 
   @orbitals.setter
   def orbitals(self, value):
+    # Release the files kept open by a previous grid
+    old = getattr(self, '_orbitals', None)
+    if (isinstance(old, Grid) and (old is not value)):
+      with old._lock:
+        old.close()
     self._orbitals = value
     self._orbitals_changed(value)
 
@@ -4411,14 +4847,23 @@ class MainWindow(QMainWindow):
     self._isovalue_changed(value, old)
 
   def _isovalue_changed(self, new, old):
-    logrange = np.log(self._maxval/self._minval)
-    reldist = np.log(new/self._minval)/logrange
+    # Scalar math (called on every slider step), math is faster than numpy here
+    logrange = math.log(self._maxval/self._minval)
+    reldist = math.log(new/self._minval)/logrange
     slider_value = round(self.isovalueSlider.maximum() - reldist * (self.isovalueSlider.maximum() + self.isovalueSlider.minimum()))
     self.isovalueSlider.blockSignals(True)
     self.isovalueSlider.setValue(slider_value)
     self.isovalueSlider.blockSignals(False)
     if (not self.isovalueBox.hasFocus()):
       fix_box(self.isovalueBox, '{0:.4g}'.format(new))
+    # Delay the contour update, so that fast consecutive changes only trigger
+    # one recomputation of the isosurfaces
+    if (self.surface is not None):
+      self.isovalueTimer.start()
+
+  def update_contour(self):
+    self.isovalueTimer.stop()
+    new = self.isovalue
     if (self.surface is not None):
       contour = get_input_type(self.surface.GetMapper(), vtk.vtkContourFilter)
       if (self.orbital == 0):
@@ -4480,7 +4925,7 @@ class MainWindow(QMainWindow):
     self.boxSizeBox.setText('def')
     self.boxSizeBox.editingFinished.emit()
     if (self.boxSize is not None):
-      self.build_grid()
+      self.gridTimer.start()
 
   @property
   def transform(self):
@@ -4497,7 +4942,7 @@ class MainWindow(QMainWindow):
       return
     self.transformDock.set_boxes(new)
     if (self.transform is not None):
-      self.build_grid()
+      self.gridTimer.start()
 
   @property
   def gridPoints(self):
@@ -4514,7 +4959,7 @@ class MainWindow(QMainWindow):
       return
     self.gridPointsBox.setText('def')
     self.gridPointsBox.editingFinished.emit()
-    self.build_grid()
+    self.gridTimer.start()
 
   @property
   def lineDensity(self):
@@ -4780,10 +5225,10 @@ class MainWindow(QMainWindow):
   def detect_format(self, infile):
     if (not os.path.isfile(infile)):
       return None
-    try:
-      with h5py.File(infile, 'r') as f:
-        return 'hdf5'
-    except (OSError, IOError):
+    # Check the HDF5 signature, without opening the file as HDF5
+    if (h5py.is_hdf5(infile)):
+      return 'hdf5'
+    else:
       with open(infile, 'rb') as f:
         line = f.readline().decode('ascii', errors='replace')
         if (re.search(r'\[MOLDEN FORMAT\]', line, re.IGNORECASE)):
@@ -4791,19 +5236,24 @@ class MainWindow(QMainWindow):
         elif (line.startswith('#INPORB')):
           return 'inporb'
         else:
+          # Read the header in bulk (enough for the geometry in a luscus file),
+          # instead of line by line
           try:
-            N = int(line)
-            line = f.readline()
-            for i in range(N):
-              line = f.readline().decode('ascii', errors='replace')
-            line = f.readline().decode('ascii', errors='replace')
-            assert (line.strip() == '<GRID>')
+            N = max(int(line), 0)
+          except ValueError:
+            N = 0
+          size = min(128*(N+2)+4096, 2**24)
+          blob = f.read(size)
+          while ((blob.count(b'\n') < N+2) and (len(blob) < 2**26)):
+            more = f.read(size)
+            if (not more):
+              break
+            blob += more
+          lines = blob.splitlines()
+          if ((N > 0) and (len(lines) > N+1) and (lines[N+1].strip() == b'<GRID>')):
             return 'luscus'
-          except:
-            f.seek(0)
-            line = f.readline()
-            line = f.readline()
-            line = f.readline().decode('ascii', errors='replace')
+          if (len(lines) > 1):
+            line = lines[1].decode('ascii', errors='replace')
             if (line.startswith('Natom=')):
               return 'grid'
             else:
@@ -4846,33 +5296,55 @@ class MainWindow(QMainWindow):
     # Enable warning after the first file has been loaded
     self.textureDock._transparency_warning = True
 
-  # Return a string with orbital information for the drop-down list
+  # Return the local numbering of each orbital in its irrep,
+  # counted in a single pass and kept while the list of orbitals is the same
+  def sym_numbers(self):
+    saved = self._sym_numbers
+    if ((saved is None) or (saved[0] is not self.MO) or (len(saved[1]) != len(self.MO))):
+      count = {}
+      numbers = []
+      for o in self.MO:
+        count[o['sym']] = count.get(o['sym'], 0) + 1
+        numbers.append(count[o['sym']])
+      self._sym_numbers = (self.MO, numbers)
+    return self._sym_numbers[1]
+
+  # Return a string with orbital information for the drop-down list,
+  # the string is stored in the orbital and only formatted again when
+  # something that appears in it changes (e.g. the new type)
   def orb_to_list(self, n, orb):
     if ('label' in orb):
       return '{0}'.format(orb['label'])
     else:
+      key = (n, self.nosym, orb.get('num'), orb['sym'], orb['ene'], orb['occup'], orb['type'], orb.get('newtype'))
+      saved = orb.get('_list_label')
+      if ((saved is not None) and (saved[0] == key)):
+        return saved[1]
       num = orb.get('num', n)
       # Build irrep and local numbering
       if (self.nosym):
         numsym = ''
       else:
-        m = [o['sym'] for o in self.MO[:n]].count(orb['sym'])
+        m = self.sym_numbers()[n-1]
         numsym = ' [{0}, {1}]'.format(orb['sym'], m)
       # Add new type if it has been modified
       tp = orb['type']
       if (('newtype' in orb) and (orb['newtype'] != tp)):
         tp += u'→' + orb['newtype']
-      return u'{0}{1}: {2:.4f} ({3:.4f}) {4}'.format(num, numsym, orb['ene'], orb['occup'], tp)
+      label = u'{0}{1}: {2:.4f} ({3:.4f}) {4}'.format(num, numsym, orb['ene'], orb['occup'], tp)
+      orb['_list_label'] = (key, label)
+      return label
 
   def populate_orbitals(self):
     prev = self.orbital
     self.orbitalButton.blockSignals(True)
     self.orbitalButton.clear()
+    self._orbital_pos = {}
     if (self.MO is None):
       return
     if (self.irrep == 'All'):
       orblist = {i+1:self.orb_to_list(i+1, o) for i,o in enumerate(self.MO) if (not o.get('hide'))}
-      orbidx = {i+1:[-snap(o['occup']), -np.inf if np.isnan(o['ene']) else o['ene'], np.copysign(1, o['occup'])]
+      orbidx = {i+1:[-snap(o['occup']), -np.inf if math.isnan(o['ene']) else o['ene'], math.copysign(1, o['occup'])]
                      for i,o in enumerate(self.MO) if (not o.get('hide'))}
       if ((not self.isGrid) and any([(o['occup'] != 0.0) for o in self.MO])):
         is_it_spin = (self.dens == 'State') and any([(o['occup'] < -1e-4) for o in self.MO])
@@ -4899,7 +5371,7 @@ class MainWindow(QMainWindow):
           orblist[0] = 'Density'
     else:
       orblist = {i+1:self.orb_to_list(i+1, o) for i,o in enumerate(self.MO) if ((o['sym'] == self.irrep) and not o.get('hide'))}
-      orbidx = {i+1:[-snap(o['occup']), -np.inf if np.isnan(o['ene']) else o['ene'], np.copysign(1, o['occup']), o['sym']]
+      orbidx = {i+1:[-snap(o['occup']), -np.inf if math.isnan(o['ene']) else o['ene'], math.copysign(1, o['occup']), o['sym']]
                      for i,o in enumerate(self.MO) if ((o['sym'] == self.irrep) and not o.get('hide'))}
     if (self.sortedBox.isChecked()):
       for k in orblist.keys():
@@ -4910,17 +5382,19 @@ class MainWindow(QMainWindow):
       orbsort = sorted(orblist.keys())
     for k in orbsort:
       self.orbitalButton.addItem(orblist[k], k)
+    # Position of each orbital in the list, to avoid searching it
+    self._orbital_pos = {k:i for i,k in enumerate(orbsort)}
     if (prev is None):
       prev = 1
-    new = self.orbitalButton.findData(prev)
+    new = self._orbital_pos.get(prev, -1)
     if ((new < 0) and (prev in [-4, -5])):
       prev = -5 if (prev == -4) else -4
-      new = self.orbitalButton.findData(prev)
+      new = self._orbital_pos.get(prev, -1)
     if (new < 0):
       prev = 1 if (prev > 0) else 0
-      new = self.orbitalButton.findData(prev)
+      new = self._orbital_pos.get(prev, -1)
     if (new < 0):
-      new = self.orbitalButton.findData(-3)
+      new = self._orbital_pos.get(-3, -1)
     if (new < 0):
       new = 0
     self.orbitalButton.setCurrentIndex(new)
@@ -4933,32 +5407,31 @@ class MainWindow(QMainWindow):
       alphaMO = self.orbitals.MO_a
     else:
       alphaMO = self.orbitals.MO
-    for i,orb in enumerate([j for i in zip_longest(alphaMO, self.orbitals.MO_b) for j in i]):
-      if (orb is None):
-        continue
-      note = {}
-      if ('label' in orb):
-        note['name'] = orb['label']
-      else:
-        if (i%2 == 0):
-          num = '{0}'.format(i//2+1)
-        else:
-          num = '{0}b'.format(i//2+1)
-        if (self.nosym):
-          note['name'] = '#{0} {1:.4f} {2}'.format(num, orb['ene'], orb['type'])
+    # Choose the name format once, alpha and beta orbitals are interleaved
+    if (self.nosym):
+      fmt = '#{0}{1} {3:.4f} {4}'
+    else:
+      fmt = '#{0}{1} [{2}] {3:.4f} {4}'
+    for n,pair in enumerate(zip_longest(alphaMO, self.orbitals.MO_b), 1):
+      for orb,suffix in zip(pair, ('', 'b')):
+        if (orb is None):
+          continue
+        note = {}
+        if ('label' in orb):
+          note['name'] = orb['label']
         else:
-          note['name'] = '#{0} [{1}] {2:.4f} {3}'.format(num, orb['sym'], orb['ene'], orb['type'])
-      note['occup'] = orb['occup']
-      # This could be nice, but it's not so good when changing states or density types
-      #note['density'] = orb['occup'] != 0
-      note['density'] = True
-      note['note'] = ''
-      notes.append(note)
-    for i,note in enumerate(notes):
-      try:
-        note['note'] = self.orbitals.notes[i]
-      except:
-        pass
+          note['name'] = fmt.format(n, suffix, orb['sym'], orb['ene'], orb['type'])
+        note['occup'] = orb['occup']
+        # This could be nice, but it's not so good when changing states or density types
+        #note['density'] = orb['occup'] != 0
+        note['density'] = True
+        note['note'] = ''
+        notes.append(note)
+    # Not all orbital sources have notes
+    orbnotes = getattr(self.orbitals, 'notes', None)
+    if (orbnotes is not None):
+      for note,text in zip(notes, orbnotes):
+        note['note'] = text
     self.notes = notes
 
   def initial_orbital(self):
@@ -4983,12 +5456,8 @@ class MainWindow(QMainWindow):
 
   def new_mol(self):
     # Assign nuclear radii
-    r = np.array([c['Z'] for c in self.orbitals.centers])
-    try:
-      r = np.cbrt(r)
-    except AttributeError:
-      r = np.power(r, 1.0/3)
-    r[r<0.5] = 0.5
+    r = np.cbrt(np.fromiter(map(itemgetter('Z'), self.orbitals.centers), dtype=float, count=len(self.orbitals.centers)))
+    np.maximum(r, 0.5, out=r)
     # Create VTK objects
     vtkr = numpy_support.numpy_to_vtk(0.1*r, 1, vtk.VTK_DOUBLE)
     vtkr.SetName('radii')
@@ -4996,9 +5465,9 @@ class MainWindow(QMainWindow):
     for c in self.orbitals.centers:
       vtkl.InsertNextValue(c['name'])
     vtkl.SetName('labels')
+    # All points are set at once from an array
     pts = vtk.vtkPoints()
-    for c in self.orbitals.centers:
-      pts.InsertNextPoint(*c['xyz'])
+    pts.SetData(numpy_support.numpy_to_vtk(np.array([c['xyz'] for c in self.orbitals.centers], dtype=float).reshape(-1, 3), 1, vtk.VTK_DOUBLE))
     pd = vtk.vtkPolyData()
     pd.SetPoints(pts)
     pd.GetPointData().AddArray(vtkl)
@@ -5023,6 +5492,14 @@ class MainWindow(QMainWindow):
     molb = vtk.vtkMolecule()
     molb.DeepCopy(bp.GetOutput())
     pt = vtk.vtkPeriodicTable()
+    # Covalent radii, looked up only once for each element present
+    # Fix missing radii being taken as 1e38 (use 1.6 instead)
+    cov = {}
+    for c in self.orbitals.centers:
+      if (c['Z'] not in cov):
+        rc = pt.GetCovalentRadius(c['Z'])
+        cov[c['Z']] = 1.6 if (rc > 10.0) else rc
+    tol = bp.GetTolerance()
     # Fix default bonds
     for i in range(molb.GetNumberOfBonds()):
       bond = molb.GetBond(i)
@@ -5031,17 +5508,14 @@ class MainWindow(QMainWindow):
       # Remove (hide) bonds with ghost and MM atoms
       if ((Z1 < 1) or (Z2 < 1)):
         molb.SetBondOrder(i, 0)
-      # Fix missing radii being taken as 1e38 (use 1.6 instead)
-      r1 = pt.GetCovalentRadius(Z1)
-      r1 = 1.6 if (r1 > 10.0) else r1
-      r2 = pt.GetCovalentRadius(Z2)
-      r2 = 1.6 if (r2 > 10.0) else r2
-      if (bond.GetLength() > r1+r2+bp.GetTolerance()):
+      elif (bond.GetLength() > cov[Z1]+cov[Z2]+tol):
         molb.SetBondOrder(i, 0)
-    # Change coordinates back to bohr
-    for i in range(molb.GetNumberOfAtoms()):
-      xyz = np.array(molb.GetAtomPosition(i))*angstrom
-      molb.SetAtomPosition(i, *xyz)
+    # Change coordinates back to bohr, in place for all atoms
+    pos = molb.GetAtomicPositionArray()
+    if (pos.GetNumberOfPoints() > 0):
+      xyz = numpy_support.vtk_to_numpy(pos.GetData())
+      xyz *= angstrom
+      pos.Modified()
     molb.GetVertexData().AddArray(vtkr)
     mol_nb.GetVertexData().AddArray(vtkr_nb)
     mm = vtk.vtkMoleculeMapper()
@@ -5090,6 +5564,9 @@ class MainWindow(QMainWindow):
       self.transform[:] = np.eye(4).flatten().tolist()
     self.boxSize = None
     self.boxSize = self.default_box()[0]
+    # The new box is needed right away (e.g. for the camera)
+    if (self.gridTimer.isActive()):
+      self.build_grid()
 
   def default_box(self, clearance=4.0):
     # Center molecule and compute max/min extent
@@ -5128,6 +5605,7 @@ class MainWindow(QMainWindow):
       self.transform[:] = np.round(t.flatten(), decimals=6).tolist()
 
   def build_grid(self):
+    self.gridTimer.stop()
     if (self.isGrid):
       # For precomputed grids, just take the defined grid
       lims = np.array([self.orbitals.orig, self.orbitals.end])
@@ -5174,7 +5652,7 @@ class MainWindow(QMainWindow):
     self.gridPointsBox.blockSignals(True)
     self.gridPointsBox.setText('{0}'.format(np.max(ngrid)))
     self.gridPointsBox.blockSignals(False)
-    self.update_cache(ngrid)
+    self.update_cache(ngrid, key=(tuple(lims.flatten()), tuple(matrix)))
     grid = vtk.vtkImageData()
     grid.SetOrigin(lims[0,:])
     grid.SetSpacing([b/(n-1) for b,n in zip(boxSize, ngrid)])
@@ -5259,11 +5737,19 @@ class MainWindow(QMainWindow):
     self.axes.AddPart(axisY)
     self.axes.AddPart(axisZ)
 
-  def update_cache(self, ngrid):
+  def update_cache(self, ngrid, key=None):
+    # If the grid is the same as for the current cache (and the same orbitals),
+    # the computed values are still valid and can be kept
+    if (key is not None):
+      key = (self.orbitals, tuple(ngrid), key)
+      old = self._cache_key
+      if ((old is not None) and (old[0] is key[0]) and (old[1:] == key[1:])):
+        return
+    self._cache_key = key
     self.scratchsize['rec'] = None
     if (self._cache_file is not None):
       filename = self._cache_file.filename
-      self._cache_file._mmap.close()
+      self._cache_file.close()
       del self._cache_file
       os.remove(filename)
       self._cache_file = None
@@ -5283,25 +5769,19 @@ class MainWindow(QMainWindow):
       self._dens_cache = None
       self._dens_list = None
     else:
-      nbas = sum(self.orbitals.N_bas)
+      nbas = self.orbitals._nbas_total
       npoints = np.prod(ngrid)
       size = nbas*npoints
-      mintype = 'float32'
-      self.scratchsize['rec'] = size*np.dtype(mintype).itemsize
-      # Select a type such that everything fits
-      for i in ['float64', mintype]:
-        if (size*np.dtype(i).itemsize <= self.scratchsize['max']):
-          dtype = i
-          break
-      else:
-        # If not possible, find out maximum size
-        dtype = mintype
+      # Single precision is enough for display, and halves the size and traffic
+      dtype = 'float32'
+      self.scratchsize['rec'] = size*np.dtype(dtype).itemsize
+      # If everything does not fit, find out maximum size
+      if (size*np.dtype(dtype).itemsize > self.scratchsize['max']):
         npoints = self.scratchsize['max']//(nbas*np.dtype(dtype).itemsize)
         self._cache_file = None
         if (npoints < 100):
           return
-      self._cache_file = np.memmap(os.path.join(self._tmpdir, '{0}.cache'.format(__name__.lower())), dtype=dtype, mode='w+', shape=(sum(self.orbitals.N_bas), npoints))
-      self._cache_file[:,0] = np.nan
+      self._cache_file = AOCache(os.path.join(self._tmpdir, '{0}.cache'.format(__name__.lower())), nbas, npoints, dtype=dtype)
       # Use remaining space for density cache
       npoints = np.prod(ngrid)
       maxdens = (self.scratchsize['max'] - self._cache_file.nbytes)//int(npoints*np.dtype(dtype).itemsize)
@@ -5471,9 +5951,14 @@ class MainWindow(QMainWindow):
       dens_type = 'attachment'
     elif (dt == 'Detachment density'):
       dens_type = 'detachment'
-    self._computeVolumeThread = ComputeVolume(self, cache=self._cache_file, dens_type=dens_type)
-    self._computeVolumeThread.disable_list = [self.setScratchAction, self.densityTypeGroup, self.rootGroup, self.irrepGroup, self.orbitalGroup, self.boxSizeGroup, self.gridPointsGroup, self.fitBoxAction, self.gradientBox, self.gradientGroup, self.transformDock]
-    self._computeVolumeThread.finished.connect(self.volume_computed)
+    # The same thread object is reused for every volume, with updated parameters
+    if (self._computeVolumeThread is None):
+      self._computeVolumeThread = ComputeVolume(self)
+      self._computeVolumeThread.disable_list = [self.setScratchAction, self.densityTypeGroup, self.rootGroup, self.irrepGroup, self.orbitalGroup, self.boxSizeGroup, self.gridPointsGroup, self.fitBoxAction, self.gradientBox, self.gradientGroup, self.transformDock]
+      self._computeVolumeThread.finished.connect(self.volume_computed)
+    self._computeVolumeThread.cache = self._cache_file
+    self._computeVolumeThread.dens_type = dens_type
+    self._computeVolumeThread.data = None
     self._computeVolumeThread.start()
 
   def volume_computed(self):
@@ -5695,10 +6180,11 @@ class MainWindow(QMainWindow):
     if (maxval == minval):
       maxval *= 1.1
     if (minval == 0):
-      minval = np.nanmin(abs(numpy_support.vtk_to_numpy(self.xyz.GetInput().GetPointData().GetScalars())))
+      minval = nanmin_abs(numpy_support.vtk_to_numpy(self.xyz.GetInput().GetPointData().GetScalars()))
       minval = max(minval, 1e-6*maxval)
     self._minval, self._maxval = (minval, maxval)
     self.isovalue = self.isovalue
+    self.update_contour()
 
   def densityTypeButton_changed(self, value):
     if (value >= 0):
@@ -5736,9 +6222,9 @@ class MainWindow(QMainWindow):
       self.spin = self.spinButton.currentText()
 
   def isovalueSlider_changed(self, value):
-    logrange = np.log(self._maxval/self._minval)
+    logrange = math.log(self._maxval/self._minval)
     reldist = (value - self.isovalueSlider.minimum())/(self.isovalueSlider.maximum() - self.isovalueSlider.minimum())
-    new = self._maxval * np.exp(-reldist*logrange)
+    new = self._maxval * math.exp(-reldist*logrange)
     self.isovalue = new
 
   def isovalueBox_changed(self, fix=False):
@@ -5881,16 +6367,16 @@ class MainWindow(QMainWindow):
     self.resetButton.setEnabled(enabled)
 
   def typeButtonGroup_changed(self):
-    try:
-      tp = str(self.typeButtonGroup.checkedButton().text())
-    except AttributeError:
+    tpid = self.typeButtonGroup.checkedId()
+    if (tpid > 0):
+      tp = list(self.typeButtons)[tpid-1]
+    else:
       tp = '?'
-    tp = tp.replace('&', '')
     if ((self.orbital is None) or (self.MO is None)):
       return
     if (self.orbital > 0):
       orb = self.MO[self.orbital-1]
-      item = self.orbitalButton.findData(self.orbital)
+      item = self._orbital_pos.get(self.orbital, -1)
       old = orb['type']
       if (tp == old):
         orb.pop('newtype', None)
@@ -5914,20 +6400,8 @@ class MainWindow(QMainWindow):
           tp = orb.get('newtype', orb['type'])
         except:
           tp = ''
-    if (tp == 'F'):
-      self.frozenButton.setChecked(True)
-    elif (tp == 'I'):
-      self.inactiveButton.setChecked(True)
-    elif (tp == '1'):
-      self.RAS1Button.setChecked(True)
-    elif (tp == '2'):
-      self.RAS2Button.setChecked(True)
-    elif (tp == '3'):
-      self.RAS3Button.setChecked(True)
-    elif (tp == 'S'):
-      self.secondaryButton.setChecked(True)
-    elif (tp == 'D'):
-      self.deletedButton.setChecked(True)
+    if (tp in self.typeButtons):
+      self.typeButtons[tp].setChecked(True)
     else:
       self.typeButtonGroup.setExclusive(False)
       for b in self.typeButtonGroup.buttons():
@@ -6004,21 +6478,21 @@ class MainWindow(QMainWindow):
           if (self.nosym):
             sym = ''
           else:
-            m = [o['sym'] for o in self.MO[:self.orbital]].count(orb['sym'])
+            m = self.sym_numbers()[self.orbital-1]
             sym = ' [{0}, {1}]'.format(orb['sym'], m)
           text += '#{0}{1}   E: {2:.6f}   occ: {3:.4f}   {4}'.format(self.orbital, sym, orb['ene'], orb['occup'], tp)
     # Update the counts
     irrep = [i for i in self.orbitals.irrep if (i != 'z')]
     nsym = len(irrep)
-    types = {k:[0]*nsym for k in ['F', 'I', '1', '2', '3', 'S', 'D']}
-    for o in self.MO:
-      try:
-        sym = irrep.index(o['sym'])
-        tp = o.get('newtype', o['type'])
-        if (tp in types):
-          types[tp][sym] += 1
-      except:
-        pass
+    typelist = ['F', 'I', '1', '2', '3', 'S', 'D']
+    # Count (type, irrep) pairs with a single histogram,
+    # orbitals with an unknown type or irrep are skipped
+    sym_to_idx = {s:i for i,s in enumerate(irrep)}
+    tp_to_idx = {t:i for i,t in enumerate(typelist)}
+    pairs = ((tp_to_idx.get(o.get('newtype', o['type'])), sym_to_idx.get(o['sym'])) for o in self.MO)
+    idx = np.array([t*nsym+s for t,s in pairs if ((t is not None) and (s is not None))], dtype=int)
+    counts = np.bincount(idx, minlength=nsym*len(typelist)).reshape(len(typelist), nsym)
+    types = {t:counts[i].tolist() for i,t in enumerate(typelist)}
     text += '\n' + '   '.join(['{0}: {1}'.format(i, ','.join(map(str, types[i]))) for i in ['F', 'I', '1', '2', '3', 'S', 'D'] if (sum(types[i]) > 0)])
     if (self.panel is None):
       self.panel = vtk.vtkTextActor()
@@ -6205,13 +6679,30 @@ class MainWindow(QMainWindow):
           axis[i] = grid[i]
           axis = transform.MultiplyPoint(axis)
           f.write('{0:5d} {1:11.6f} {2:11.6f} {3:11.6f}\n'.format(ngrid[i], *axis))
-        for c in self.orbitals.centers:
-          f.write('{0:5d} {0:11.6f} {1:11.6f} {2:11.6f} {3:11.6f}\n'.format(c['Z'], *c['xyz']))
+        f.write(''.join(['{0:5d} {0:11.6f} {1:11.6f} {2:11.6f} {3:11.6f}\n'.format(c['Z'], *c['xyz']) for c in self.orbitals.centers]))
         vol = numpy_support.vtk_to_numpy(data.GetPointData().GetScalars()).reshape(ngrid[::-1]).T
-        for x in vol:
-          for y in x:
-            f.write('\n'.join(wrap_list(y, 6, '{:13.5E}')))
-            f.write('\n')
+        # Each z row is written in lines of 6 values. Build the format for
+        # one row and write many rows with a single format call
+        nz = ngrid[2]
+        lines = ['{:13.5E}'*6]*(nz//6)
+        if (nz % 6 > 0):
+          lines.append('{:13.5E}'*(nz % 6))
+        rowfmt = '\n'.join(lines) + '\n'
+        rows = vol.reshape(-1, nz)
+        nrows = max(1, 2**16//max(1, nz))
+        # Formatting is bound to the interpreter, so it cannot run in parallel,
+        # but each block is written in a separate thread while the next one
+        # is being formatted
+        with ThreadPoolExecutor(max_workers=1) as pool:
+          pending = None
+          for i in range(0, rows.shape[0], nrows):
+            block = rows[i:i+nrows]
+            text = (rowfmt*block.shape[0]).format(*block.ravel())
+            if (pending is not None):
+              pending.result()
+            pending = pool.submit(f.write, text)
+          if (pending is not None):
+            pending.result()
     except Exception as e:
       error = 'Error writing cube file {0}:\n{1}'.format(filename, e)
       traceback.print_exc()
@@ -6230,46 +6721,54 @@ class MainWindow(QMainWindow):
 
   # Copy an InpOrb file, changing header and index section
   def patch_inporb(self, outfile):
-    with open(self.orbitals.file, 'r') as f:
+    with open(self.orbitals.file, 'r', buffering=2**20) as f:
       f.seek(self.orbitals.inporb)
-      # Write to a temporary file if overwriting
+      # Write to a temporary file if overwriting, with large buffers
       if (outfile == self.orbitals.file):
-        fo = TemporaryFile(mode='w+', dir=self._tmpdir)
+        fo = TemporaryFile(mode='w+', buffering=2**20, dir=self._tmpdir)
       else:
-        fo = open(outfile, 'w')
-      line = f.readline()
-      while (line != ''):
-        fo.write(line)
-        line = f.readline()
-        # In the header, modify only the title, but read numbers of orbitals
-        if (line.startswith('#INFO')):
-          fo.write(line)
-          line = f.readline()
-          fo.write('* File generated by {0} from {1}\n'.format(__name__, self.filename))
-          line = f.readline()
-          fo.write(line)
-          line = f.readline()
-          fo.write(line)
-          line = f.readline()
-          fo.write(line)
-          line = f.readline()
-          fo.write(line)
-          line = f.readline()
-        # Read the existing index section
-        if (line.startswith('#INDEX')):
-          fo.write(line)
-          index = []
-          line = f.readline()
-          while (line and (line.lstrip()[0] not in ['#', '<'])):
-            if (line[0] == '*'):
-              index.append('')
-            else:
-              index[-1] += line.split()[1]
-            line = f.readline()
-          nMO = OrderedDict()
-          for i,l in enumerate(index):
-            nMO[self.orbitals.irrep[i]] = len(l)
+        fo = open(outfile, 'w', buffering=2**20)
+      # Copy everything in large blocks, only the header and index
+      # sections are processed line by line
+      buf, tag = copy_until(f, fo, f.read(2**16), ['#INFO', '#INDEX'])
+      # In the header, modify only the title
+      if (tag == '#INFO'):
+        while (buf.count('\n') < 6):
+          more = f.read(2**16)
+          if (not more):
+            break
+          buf += more
+        lines = buf.split('\n', 6)
+        if (len(lines) < 7):
+          error = 'Incomplete #INFO section'
+          raise Exception(error)
+        lines[1] = '* File generated by {0} from {1}'.format(__name__, self.filename)
+        fo.write('\n'.join(lines[:6]) + '\n')
+        buf = lines[6]
+        # The orbitals make up most of the file, copy them in larger blocks
+        if (buf.startswith('#INDEX')):
+          tag = '#INDEX'
+        else:
+          buf, tag = copy_until(f, fo, buf, ['#INDEX'], size=2**20)
+      if (tag != '#INDEX'):
+        error = 'No #INDEX section found'
+        raise Exception(error)
+      # Read the existing index section
+      lines = (buf + f.read()).split('\n')
+      fo.write(lines[0] + '\n')
+      # Collect the pieces of each irrep and join them at the end
+      index = []
+      for line in lines[1:]:
+        if ((not line.strip()) or (line.lstrip()[0] in ['#', '<'])):
           break
+        if (line[0] == '*'):
+          index.append([])
+        else:
+          index[-1].append(line.split()[1])
+      index = [''.join(i) for i in index]
+      nMO = OrderedDict()
+      for i,l in enumerate(index):
+        nMO[self.orbitals.irrep[i]] = len(l)
       if (self.orbitals.MO_b):
         alphaMO = self.orbitals.MO_a
       else:
@@ -6280,87 +6779,48 @@ class MainWindow(QMainWindow):
           self.show_error(error)
           return
       # Write the new index section
-      fo.write('\n'.join(index))
-      fo.write('\n')
+      fo.write('\n'.join(index) + '\n')
     # Copy back from temporary file if overwriting
     if (outfile == self.orbitals.file):
       fo.seek(0)
-      with open(outfile, 'w') as ffo:
-        for line in fo:
-          ffo.write(line)
+      with open(outfile, 'w', buffering=2**20) as ffo:
+        copyfileobj(fo, ffo, 2**20)
     fo.close()
 
-  def prev_dens(self):
-    if (not self.densityTypeButton.isEnabled()):
+  # Select the previous or next item in a drop-down list, only if it is enabled,
+  # and disabling it while the change is processed
+  def step_button(self, button, step):
+    if (not button.isEnabled()):
       return
-    self.densityTypeButton.setEnabled(False)
-    index = self.densityTypeButton.currentIndex()
-    if (index > 0):
-      self.densityTypeButton.setCurrentIndex(index-1)
-    self.densityTypeButton.setEnabled(True)
+    button.setEnabled(False)
+    index = button.currentIndex() + step
+    if (0 <= index < button.count()):
+      button.setCurrentIndex(index)
+    button.setEnabled(True)
+
+  def prev_dens(self):
+    self.step_button(self.densityTypeButton, -1)
 
   def next_dens(self):
-    if (not self.densityTypeButton.isEnabled()):
-      return
-    self.densityTypeButton.setEnabled(False)
-    index = self.densityTypeButton.currentIndex()
-    if (index < self.densityTypeButton.count()-1):
-      self.densityTypeButton.setCurrentIndex(index+1)
-    self.densityTypeButton.setEnabled(True)
+    self.step_button(self.densityTypeButton, 1)
 
   def prev_root(self):
-    if (not self.rootButton.isEnabled()):
-      return
-    self.rootButton.setEnabled(False)
-    index = self.rootButton.currentIndex()
-    if (index > 0):
-      self.rootButton.setCurrentIndex(index-1)
-    self.rootButton.setEnabled(True)
+    self.step_button(self.rootButton, -1)
 
   def next_root(self):
-    if (not self.rootButton.isEnabled()):
-      return
-    self.rootButton.setEnabled(False)
-    index = self.rootButton.currentIndex()
-    if (index < self.rootButton.count()-1):
-      self.rootButton.setCurrentIndex(index+1)
-    self.rootButton.setEnabled(True)
+    self.step_button(self.rootButton, 1)
 
   def prev_irrep(self):
-    if (not self.irrepButton.isEnabled()):
-      return
-    self.irrepButton.setEnabled(False)
-    index = self.irrepButton.currentIndex()
-    if (index > 0):
-      self.irrepButton.setCurrentIndex(index-1)
-    self.irrepButton.setEnabled(True)
+    self.step_button(self.irrepButton, -1)
 
   def next_irrep(self):
-    if (not self.irrepButton.isEnabled()):
-      return
-    self.irrepButton.setEnabled(False)
-    index = self.irrepButton.currentIndex()
-    if (index < self.irrepButton.count()-1):
-      self.irrepButton.setCurrentIndex(index+1)
-    self.irrepButton.setEnabled(True)
+    self.step_button(self.irrepButton, 1)
 
   def prev_orbital(self):
-    if (not self.orbitalButton.isEnabled()):
-      return
-    self.orbitalButton.setEnabled(False)
-    index = self.orbitalButton.currentIndex()
-    if (index > 0):
-      self.orbitalButton.setCurrentIndex(index-1)
-    self.orbitalButton.setEnabled(True)
+    self.step_button(self.orbitalButton, -1)
 
   def next_orbital(self):
-    if (not self.orbitalButton.isEnabled()):
-      return
-    self.orbitalButton.setEnabled(False)
-    index = self.orbitalButton.currentIndex()
-    if (index < self.orbitalButton.count()-1):
-      self.orbitalButton.setCurrentIndex(index+1)
-    self.orbitalButton.setEnabled(True)
+    self.step_button(self.orbitalButton, 1)
 
   def select_alpha(self):
     if (not self.spinButton.isEnabled()):
@@ -6387,45 +6847,27 @@ class MainWindow(QMainWindow):
     if (index >= 0):
       self.spinButton.setCurrentIndex(index)
 
-  def increase_isovalue(self, more=False):
-    if (not self.isovalueSlider.isEnabled()):
+  # Move a slider by a single or page step, only if it is enabled
+  def step_slider(self, slider, direction, more=False):
+    if (not slider.isEnabled()):
       return
-    value = self.isovalueSlider.value()
     if (more):
-      step = self.isovalueSlider.pageStep()
+      step = slider.pageStep()
     else:
-      step = self.isovalueSlider.singleStep()
-    self.isovalueSlider.setValue(value-step)
+      step = slider.singleStep()
+    slider.setValue(slider.value()+direction*step)
+
+  def increase_isovalue(self, more=False):
+    self.step_slider(self.isovalueSlider, -1, more)
 
   def decrease_isovalue(self, more=False):
-    if (not self.isovalueSlider.isEnabled()):
-      return
-    value = self.isovalueSlider.value()
-    if (more):
-      step = self.isovalueSlider.pageStep()
-    else:
-      step = self.isovalueSlider.singleStep()
-    self.isovalueSlider.setValue(value+step)
+    self.step_slider(self.isovalueSlider, 1, more)
 
   def increase_opacity(self, more=False):
-    if (not self.opacitySlider.isEnabled()):
-      return
-    value = self.opacitySlider.value()
-    if (more):
-      step = self.opacitySlider.pageStep()
-    else:
-      step = self.opacitySlider.singleStep()
-    self.opacitySlider.setValue(value+step)
+    self.step_slider(self.opacitySlider, 1, more)
 
   def decrease_opacity(self, more=False):
-    if (not self.opacitySlider.isEnabled()):
-      return
-    value = self.opacitySlider.value()
-    if (more):
-      step = self.opacitySlider.pageStep()
-    else:
-      step = self.opacitySlider.singleStep()
-    self.opacitySlider.setValue(value-step)
+    self.step_slider(self.opacitySlider, -1, more)
 
   def prev_sign(self):
     if (not self.signButton.isEnabled()):
@@ -6670,45 +7112,33 @@ class ListDock(QDockWidget):
   def note(self, num):
     self.parent().notes[num]['note'] = str(self.orbNotes[num].text())
 
-  def select_all(self):
-    self.modified = False
-    self.ready = False
-    for i in self.orbCheckBoxes:
-      if (i.isEnabled()):
-        i.setChecked(True)
-    self.ready = True
-    if (self.modified):
+  # Set the density flag of all (enabled) orbitals at once, without
+  # going through the signal of each checkbox, and redraw only once
+  def set_densities(self, values):
+    modified = False
+    for c,orb,v in zip(self.orbCheckBoxes, self.parent().notes, values):
+      if (c.isEnabled() and (c.isChecked() != v)):
+        c.blockSignals(True)
+        c.setChecked(v)
+        c.blockSignals(False)
+        orb['density'] = v
+        modified = True
+    if (modified):
+      self.modified = True
       self.redraw()
 
+  def select_all(self):
+    self.set_densities([True]*len(self.orbCheckBoxes))
+
   def select_active(self):
-    self.modified = False
-    self.ready = False
     if (self.parent().orbitals.MO_b):
       alphaMO = self.parent().orbitals.MO_a
     else:
       alphaMO = self.parent().orbitals.MO
-    for i,o in zip(self.orbCheckBoxes, [j for i in zip_longest(alphaMO, self.parent().orbitals.MO_b) for j in i if (j is not None)]):
-      if (i.isEnabled()):
-        tp = o['type']
-        if ('newtype' in o):
-          tp = o['newtype']
-        if (tp in ['1', '2', '3']):
-          i.setChecked(True)
-        else:
-          i.setChecked(False)
-    self.ready = True
-    if (self.modified):
-      self.redraw()
+    self.set_densities([o.get('newtype', o['type']) in ['1', '2', '3'] for i in zip_longest(alphaMO, self.parent().orbitals.MO_b) for o in i if (o is not None)])
 
   def select_none(self):
-    self.modified = False
-    self.ready = False
-    for i in self.orbCheckBoxes:
-      if (i.isEnabled()):
-        i.setChecked(False)
-    self.ready = True
-    if (self.modified):
-      self.redraw()
+    self.set_densities([False]*len(self.orbCheckBoxes))
 
   def redraw(self):
     if (self.parent().orbital < 1):
@@ -7539,9 +7969,9 @@ class TextureDock(QDockWidget):
   def _power_changed(self, new, old):
     if (new == old):
       return
-    logrange = np.log(300/0.03)
-    reldist = np.log(new/0.03)/logrange
-    reldist = np.clip(reldist, 0, 1)
+    logrange = math.log(300/0.03)
+    reldist = math.log(new/0.03)/logrange
+    reldist = min(max(reldist, 0), 1)
     slider_value = round(self.powerSlider.minimum() + reldist * (self.powerSlider.maximum() + self.powerSlider.minimum()))
     self.powerSlider.blockSignals(True)
     self.powerSlider.setValue(slider_value)
@@ -7554,9 +7984,9 @@ class TextureDock(QDockWidget):
     self.parent().vtk_update()
 
   def powerSlider_changed(self, value):
-    logrange = np.log(300/0.03)
+    logrange = math.log(300/0.03)
     reldist = (value - self.powerSlider.minimum())/(self.powerSlider.maximum() - self.powerSlider.minimum())
-    new = 0.03*np.exp(reldist*logrange)
+    new = 0.03*math.exp(reldist*logrange)
     self.power = float(new)
 
   def powerBox_changed(self, fix=False):